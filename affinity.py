@@ -0,0 +1,131 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""CPU pinning of processes and threads.
+
+Threads are pinned in-process with ``os.sched_setaffinity``. If that is
+not permitted, all remaining threads are pinned by a single privileged
+helper (this module run through sudo) instead of one ``taskset`` per
+thread.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def parse_cpu_list(cpus):
+    """ Convert a CPU list to a set of CPU numbers
+
+    :param cpus: CPU number, list of CPU numbers or string in taskset
+        list format, e.g. '6', '6,7' or '8-11,14'
+    :returns: set of CPU numbers
+    """
+    if isinstance(cpus, int):
+        return {cpus}
+    if isinstance(cpus, (list, tuple, set)):
+        result = set()
+        for cpu in cpus:
+            result |= parse_cpu_list(cpu)
+        return result
+    result = set()
+    for part in str(cpus).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            result |= set(range(int(first), int(last) + 1))
+        else:
+            result.add(int(part))
+    return result
+
+
+def format_cpu_list(cpus):
+    """ Convert a set of CPU numbers to taskset list format
+
+    :returns: string, e.g. '6,7,8'
+    """
+    return ','.join(str(cpu) for cpu in sorted(cpus))
+
+
+def pin_threads(pairs):
+    """ Pin every thread to its CPUs
+
+    :param pairs: iterable of (tid, cpus) pairs; cpus is accepted in any
+        format understood by ``parse_cpu_list``
+    :returns: dict mapping every tid to None on success or to an error
+        message
+    """
+    results = {}
+    denied = []
+    for tid, cpus in pairs:
+        tid = int(tid)
+        try:
+            cpu_set = parse_cpu_list(cpus)
+        except ValueError:
+            results[tid] = 'invalid CPU list %r' % (cpus,)
+            continue
+        error = _pin(tid, cpu_set)
+        if error is PermissionError:
+            denied.append((tid, cpu_set))
+        else:
+            results[tid] = error
+
+    if denied:
+        if os.geteuid() == 0:
+            for tid, _ in denied:
+                results[tid] = 'permission denied'
+        else:
+            results.update(_pin_privileged(denied))
+    return results
+
+
+def _pin(tid, cpu_set):
+    try:
+        os.sched_setaffinity(tid, cpu_set)
+    except PermissionError:
+        return PermissionError
+    except ProcessLookupError:
+        return 'no such thread'
+    except OSError as exc:
+        return str(exc)
+    return None
+
+
+def _pin_privileged(pairs):
+    """ Pin ``pairs`` of (tid, cpu set) with one sudo helper process
+    """
+    cmd = ['sudo', sys.executable, os.path.abspath(__file__)]
+    cmd += ['%d@%s' % (tid, format_cpu_list(cpu_set))
+            for tid, cpu_set in pairs]
+    _LOGGER.debug('Pinning %d threads with %s', len(pairs), ' '.join(cmd))
+    try:
+        output = subprocess.check_output(cmd)
+        return dict((int(tid), error)
+                    for tid, error in json.loads(output.decode()).items())
+    except (OSError, ValueError, subprocess.CalledProcessError) as exc:
+        return dict((tid, 'privileged helper failed: %s' % exc)
+                    for tid, _ in pairs)
+
+
+def main(args):
+    """ Privileged helper entry point
+
+    Pins each 'tid@cpus' argument and prints the results as JSON.
+    """
+    results = {}
+    for arg in args:
+        tid, _, cpus = arg.partition('@')
+        error = _pin(int(tid), parse_cpu_list(cpus))
+        if error is PermissionError:
+            error = 'permission denied'
+        results[tid] = error
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,182 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""Asyncio counterparts of the task management helpers in ``tasks``.
+
+Commands are run and process trees terminated from one event loop, so
+independent operations on many VMs and helper commands overlap without a
+thread per process. Long-running processes stay ``tasks.Process``
+instances, as their output has to be drained after the loop returned.
+"""
+
+import asyncio
+import codecs
+import locale
+import logging
+import os
+import subprocess
+import sys
+
+from conf import settings
+import systeminfo
+import tasks
+
+_READ_CHUNK = 65536
+
+
+async def run_task(cmd, logger, msg=None, check_error=False, timeout=None,
+                   limit_kb=None):
+    """Run task, report errors and log overall status.
+
+    Async version of ``tasks.run_task``. Prints stdout to screen if in
+    verbose mode and returns it regardless. Prints stderr to screen
+    always. Only the last TASK_OUTPUT_LIMIT_KB of each stream is kept.
+
+    :param cmd: Exact command to be executed
+    :param logger: Logger to write details to
+    :param msg: Message to be shown to user
+    :param check_error: Throw exception on error
+    :param timeout: Maximum run time in seconds; the process is killed
+        and ``subprocess.TimeoutExpired`` handled as error once it elapsed
+    :param limit_kb: Output kept per stream in KB, defaults to
+        TASK_OUTPUT_LIMIT_KB; 0 keeps everything
+
+    :returns: (stdout, stderr)
+    """
+    def handle_error(exception):
+        """Handle errors by logging and optionally raising an exception.
+        """
+        logger.error(
+            'Unable to execute %(cmd)s. Exception: %(exception)s',
+            {'cmd': ' '.join(cmd), 'exception': exception})
+        if check_error:
+            raise exception
+
+    my_encoding = locale.getdefaultlocale()[1]
+    if limit_kb is None:
+        limit_kb = settings.getValue('TASK_OUTPUT_LIMIT_KB')
+    limit = int(limit_kb * 1024) or None
+    echo_stdout = settings.getValue('VERBOSITY') == 'debug'
+    stdout = tasks.OutputBuffer(limit)
+    stderr = tasks.OutputBuffer(limit)
+
+    if msg:
+        logger.info(msg)
+
+    logger.debug('%s%s', tasks.CMD_PREFIX, ' '.join(cmd))
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *[os.path.expanduser(arg) for arg in cmd],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as ex:
+        handle_error(ex)
+        return '', ''
+
+    try:
+        await asyncio.wait_for(asyncio.gather(
+            _drain(proc.stdout, stdout, sys.stdout if echo_stdout else None,
+                   my_encoding),
+            _drain(proc.stderr, stderr, sys.stderr, my_encoding),
+            proc.wait()), timeout)
+    except asyncio.TimeoutError:
+        await terminate(proc, '-9', logger=logger)
+        handle_error(subprocess.TimeoutExpired(cmd, timeout))
+    else:
+        if proc.returncode:
+            handle_error(subprocess.CalledProcessError(
+                proc.returncode, cmd, stderr.getvalue()))
+
+    return ('\n'.join(stdout.lines(my_encoding)),
+            '\n'.join(stderr.lines(my_encoding)))
+
+async def _drain(stream, buffer, echo, encoding):
+    """Read ``stream`` into ``buffer`` until EOF, echoing it if requested
+    """
+    decoder = codecs.getincrementaldecoder(encoding or 'utf-8')('replace')
+    while True:
+        data = await stream.read(_READ_CHUNK)
+        if not data:
+            break
+        buffer.append(data)
+        if echo:
+            echo.write(decoder.decode(data))
+            echo.flush()
+
+async def wait_for_exit(pid, timeout_ms):
+    """Wait until process with given pid exits
+
+    The pidfd of the process is watched by the event loop; without
+    pidfd support the process state is polled.
+
+    :param pid: Process ID to wait for
+    :param timeout_ms: Maximum delay in milliseconds
+
+    :returns: True if the process has exited
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(int(pid))
+    except ProcessLookupError:
+        return True
+    except (AttributeError, OSError):
+        return await loop.run_in_executor(None, tasks.wait_for_exit, pid,
+                                          timeout_ms)
+
+    exited = loop.create_future()
+
+    def on_exit():
+        if not exited.done():
+            exited.set_result(True)
+    loop.add_reader(pidfd, on_exit)
+    try:
+        return await asyncio.wait_for(exited, max(timeout_ms, 0) / 1000.0)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+
+async def terminate(proc, signal='-15', timeout_ms=10000, logger=None,
+                    kill_timeout_ms=None):
+    """Terminate process and all its descendants
+
+    Async version of ``tasks.terminate_task_subtree``; all processes of
+    the tree are signalled together and awaited concurrently. Processes
+    which did not terminate within ``timeout_ms`` are killed by SIGKILL,
+    unless the signal was SIGKILL.
+
+    :param proc: ``asyncio.subprocess.Process`` or process ID
+    :param signal: Signal to be sent to the processes
+    :param timeout_ms: Maximum delay in milliseconds after signal is sent
+    :param logger: Logger to write details to
+    :param kill_timeout_ms: Maximum delay in milliseconds after SIGKILL
+        is sent on escalation; defaults to ``timeout_ms``
+
+    :returns: True if all processes have terminated
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    if kill_timeout_ms is None:
+        kill_timeout_ms = timeout_ms
+    pid = proc if isinstance(proc, int) else proc.pid
+    if isinstance(proc, int) or proc.returncode is None:
+        pids = [pid] + systeminfo.get_descendants(pid)
+    else:
+        pids = []
+
+    for sig, timeout in ((signal, timeout_ms), ('-9', kill_timeout_ms)):
+        pids = [pid for pid in pids if systeminfo.pid_isalive(pid)]
+        if not pids:
+            break
+        tasks.send_signal(pids, sig, logger)
+        logger.debug('Wait for processes %s to terminate after signal %s',
+                     ' '.join(str(pid) for pid in pids), sig)
+        exited = await asyncio.gather(*[wait_for_exit(pid, timeout)
+                                        for pid in pids])
+        pids = [pid for pid, done in zip(pids, exited) if not done]
+        if sig.lstrip('-').upper() in ('9', 'KILL', 'SIGKILL'):
+            break
+
+    if not isinstance(proc, int) and not pids:
+        await proc.wait()
+    return not pids
+
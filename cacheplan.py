@@ -0,0 +1,250 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""Offline planner for contiguous L3 capacity bitmasks (CBM).
+
+Given the number of cache ways of the host and the min/max ways of
+every workload, ``plan`` computes a contiguous bitmask per workload and
+cache domain, or raises ``InfeasibleError`` listing why no layout
+exists. Nothing is allocated, so an impossible WL*_CA/WL*_COS
+configuration is rejected before any VM is started.
+
+Two modes are supported:
+
+isolation
+    No two workloads on the same cache domain share a way. Every
+    workload gets its min ways; remaining ways are handed out one at a
+    time up to the max ways of each workload.
+sharing
+    Exclusive workloads get their min ways of their own. All other
+    workloads get up to their max ways from the rest of the cache and
+    overlap as little as possible.
+
+Bit 0 of every mask is the lowest cache way; ways below
+``reserved`` are never given to a workload and stay with the root group.
+"""
+
+from collections import namedtuple
+
+ISOLATION = 'isolation'
+SHARING = 'sharing'
+MODES = (ISOLATION, SHARING)
+
+# cache requirement of a workload; domains are the ids of the cache
+# domains its cores are on
+Requirement = namedtuple('Requirement', ['name', 'min_ways', 'max_ways',
+                                         'domains', 'exclusive'])
+
+# planned allocation of a workload; masks hold a bitmask for every cache
+# domain, ways and expected_ways only the domains the workload is on.
+# expected_ways counts a way shared by n workloads as 1/n.
+Allocation = namedtuple('Allocation', ['name', 'masks', 'ways',
+                                       'expected_ways'])
+
+
+class InfeasibleError(RuntimeError):
+    """
+    No cache layout satisfies the requirements.
+    """
+    def __init__(self, reasons):
+        super(InfeasibleError, self).__init__(
+            'No feasible cache allocation: ' + '; '.join(reasons))
+        self.reasons = reasons
+
+
+class Plan(object):
+    """
+    Cache layout computed by ``plan``.
+    """
+    def __init__(self, ways, mode, allocations, free):
+        """
+        :param ways: Number of cache ways per domain
+        :param mode: ISOLATION or SHARING
+        :param allocations: dict mapping workload names to Allocations
+        :param free: dict mapping every domain to the mask of the ways
+            not given to any workload
+        """
+        self.ways = ways
+        self.mode = mode
+        self.allocations = allocations
+        self.free = free
+
+    def summary(self):
+        """
+        Return the planned ways, masks and expected ways of every
+        workload by cache domain.
+        """
+        result = {}
+        for name, alloc in self.allocations.items():
+            result[name] = dict(
+                (domain, {'ways': alloc.ways[domain],
+                          'mask': '%x' % alloc.masks[domain],
+                          'expected_ways': alloc.expected_ways[domain]})
+                for domain in alloc.ways)
+        return result
+
+    def log(self, logger):
+        """
+        Log the planned allocation of every workload.
+        """
+        for name in sorted(self.allocations):
+            alloc = self.allocations[name]
+            for domain in sorted(alloc.ways):
+                logger.info('%s domain %d: %d of %d cache ways (mask %x), '
+                            '%.2f expected', name, domain, alloc.ways[domain],
+                            self.ways, alloc.masks[domain],
+                            alloc.expected_ways[domain])
+
+
+def plan(requirements, ways, domains=(0,), mode=ISOLATION, min_cbm_bits=1,
+         reserved=0):
+    """
+    Compute a contiguous bitmask layout for ``requirements``.
+
+    :param requirements: list of Requirement, in priority order
+    :param ways: Number of cache ways of every domain
+    :param domains: Ids of all cache domains
+    :param mode: ISOLATION or SHARING
+    :param min_cbm_bits: Minimum number of ways of a mask
+    :param reserved: Number of lowest ways kept for the root group
+    :returns: Plan
+    :raises InfeasibleError: listing every reason no layout exists
+    """
+    reasons = []
+    if mode not in MODES:
+        raise InfeasibleError(['unknown mode %r' % mode])
+    capacity = ways - reserved
+    for req in requirements:
+        if req.min_ways > req.max_ways:
+            reasons.append('%s: min %d ways exceed max %d ways' %
+                           (req.name, req.min_ways, req.max_ways))
+        if max(req.min_ways, min_cbm_bits) > capacity:
+            reasons.append('%s: needs %d ways, only %d of %d ways can be '
+                           'allocated' % (req.name, max(req.min_ways,
+                                                        min_cbm_bits),
+                                          capacity, ways))
+        unknown = set(req.domains) - set(domains)
+        if unknown:
+            reasons.append('%s: unknown cache domains %s' %
+                           (req.name, ', '.join(str(dom)
+                                                for dom in sorted(unknown))))
+    if reasons:
+        raise InfeasibleError(reasons)
+
+    full = (1 << ways) - 1
+    placed = dict((req.name, {}) for req in requirements)
+    free = {}
+    for domain in domains:
+        local = [req for req in requirements if domain in req.domains]
+        if mode == ISOLATION:
+            layout = _isolate(local, capacity, min_cbm_bits, domain, reasons)
+        else:
+            layout = _share(local, capacity, min_cbm_bits, domain, reasons)
+        used = 0
+        for name, (start, count) in layout.items():
+            placed[name][domain] = ((1 << count) - 1) << (start + reserved)
+            used |= placed[name][domain]
+        free[domain] = full & ~used
+    if reasons:
+        raise InfeasibleError(reasons)
+
+    allocations = {}
+    for req in requirements:
+        masks = dict((domain, placed[req.name].get(domain, full))
+                     for domain in domains)
+        allocations[req.name] = Allocation(
+            req.name, masks,
+            dict((domain, bin(mask).count('1'))
+                 for domain, mask in placed[req.name].items()),
+            dict((domain, _expected_ways(mask, [placed[other.name][domain]
+                                                for other in requirements
+                                                if domain in placed[
+                                                    other.name]]))
+                 for domain, mask in placed[req.name].items()))
+    return Plan(ways, mode, allocations, free)
+
+
+def _isolate(requirements, capacity, min_cbm_bits, domain, reasons,
+             keep=0):
+    """
+    Lay out non-overlapping blocks from the highest way downwards.
+
+    Every workload gets its min ways first; the rest of the capacity but
+    ``keep`` ways is then handed out one way at a time up to the max
+    ways of each workload.
+
+    :returns: dict mapping names to (start, count) within the capacity
+    """
+    counts = [max(req.min_ways, min_cbm_bits) for req in requirements]
+    if sum(counts) > capacity:
+        reasons.append('domain %d: %s need at least %d ways together, %d '
+                       'available' % (domain, ', '.join(
+                           req.name for req in requirements), sum(counts),
+                                      capacity))
+        return {}
+    leftover = max(capacity - sum(counts) - keep, 0)
+    while leftover:
+        grown = False
+        for index, req in enumerate(requirements):
+            if leftover and counts[index] < req.max_ways:
+                counts[index] += 1
+                leftover -= 1
+                grown = True
+        if not grown:
+            break
+    layout = {}
+    top = capacity
+    for req, count in zip(requirements, counts):
+        top -= count
+        layout[req.name] = (top, count)
+    return layout
+
+
+def _share(requirements, capacity, min_cbm_bits, domain, reasons):
+    """
+    Give exclusive workloads their own blocks at the top and spread all
+    other workloads evenly over the rest.
+
+    Exclusive workloads only grow beyond their min ways as far as the
+    largest min ways of the other workloads still fit below them.
+
+    :returns: dict mapping names to (start, count) within the capacity
+    """
+    exclusive = [req for req in requirements if req.exclusive]
+    shared = [req for req in requirements if not req.exclusive]
+    needed = [max(req.min_ways, min_cbm_bits) for req in shared]
+    region = capacity - sum(max(req.min_ways, min_cbm_bits)
+                            for req in exclusive)
+    for req, count in zip(shared, needed):
+        if count > region:
+            reasons.append('domain %d: %s needs %d ways, %d left by the '
+                           'exclusive workloads' %
+                           (domain, req.name, count, max(region, 0)))
+    layout = _isolate(exclusive, capacity, min_cbm_bits, domain, reasons,
+                      max(needed or [0]))
+    if reasons or len(layout) != len(exclusive):
+        return {}
+    region = capacity - sum(count for _, count in layout.values())
+    if not shared:
+        return layout
+    counts = [min(max(req.max_ways, min_cbm_bits), region) for req in shared]
+    for index, (req, count) in enumerate(zip(shared, counts)):
+        if len(shared) > 1:
+            start = int(round(index * (region - count) /
+                              float(len(shared) - 1)))
+        else:
+            start = region - count
+        layout[req.name] = (start, count)
+    return layout
+
+
+def _expected_ways(mask, masks):
+    """
+    Count the ways of ``mask``, a way shared by n of ``masks`` as 1/n.
+    """
+    expected = 0.0
+    way = 0
+    while mask >> way:
+        if mask >> way & 1:
+            expected += 1.0 / sum(1 for other in masks if other >> way & 1)
+        way += 1
+    return expected
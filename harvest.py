@@ -0,0 +1,439 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""Collect the stress-ng metrics written to the shared drives of the VMs.
+
+Every QEMU instance exposes /tmp/qemu<N>_share to the guest as a FAT
+drive. A guest running stress-ng with ``--yaml <file>`` or with
+``--metrics-brief --log-file <file>`` on that drive leaves the bogo-ops
+and times of every stressor there. ``Harvester`` picks those files up
+while the VMs run and after they stopped, and keeps a time series of
+runs per VM:
+
+* YAML files (*.yaml, *.yml) are parsed with PyYAML if it is installed,
+  once their size and modification time did not change between two
+  collections; a rewritten file is counted again.
+* All other files are read as text; only lines appended since the last
+  read are parsed, so a log file collecting many runs is not counted
+  twice. The metrics of a run are kept open until the run is completed
+  or the next run starts, so a run written across two reads is counted
+  as one.
+
+QemuVM.stop copies the files to an archive dir per VM instance before
+the shared dir is removed, see ``archive``; the harvester reads the
+archive once the shared dir is gone and keeps the files of every
+instance apart.
+
+Runs are stamped with the host time at which they were first seen: the
+modification times of files on the FAT drive come from the guest clock
+with a resolution of 2 s, so they are only kept as ``mtime``.
+"""
+
+import fnmatch
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from collections import namedtuple
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PATTERNS = ('*.yaml', '*.yml', '*.log', '*.txt')
+
+# metrics of one stressor of a stress-ng run; times in seconds,
+# ops_per_sec by real time, ops_per_cpu_sec by usr+sys time
+Metric = namedtuple('Metric', ['stressor', 'bogo_ops', 'real_time',
+                               'usr_time', 'sys_time', 'ops_per_sec',
+                               'ops_per_cpu_sec'])
+
+# metrics of all stressors of one stress-ng run; time is the host time
+# the run was found at, mtime the modification time of the file it was
+# read from and instance the VM instance that wrote it, if known
+Run = namedtuple('Run', ['time', 'source', 'metrics', 'mtime', 'instance'])
+
+# --metrics-brief line: stressor, bogo ops, real/usr/sys time, bogo ops/s
+# by real and usr+sys time; newer versions append more columns
+_METRICS_LINE = re.compile(
+    r'^(?:stress-ng:\s*\w+:\s*\[\d+\]\s*)?([A-Za-z][\w-]*)\s+(\d+)'
+    r'\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)(?:\s|$)')
+
+_RUN_START = re.compile(r'\bstressor\s+bogo ops\b|\bdispatching hogs\b')
+_RUN_END = re.compile(r'\brun completed\b')
+
+_YAML_WARNED = []
+
+
+def _import_yaml():
+    try:
+        import yaml
+    except ImportError:
+        if not _YAML_WARNED:
+            _LOGGER.warning('PyYAML is not installed, stress-ng YAML '
+                            'metrics are ignored')
+            _YAML_WARNED.append(True)
+        return None
+    return yaml
+
+
+def parse_text(text):
+    """
+    Return the Metrics of the stress-ng --metrics-brief lines in
+    ``text``, one list per run.
+    """
+    runs, metrics = _parse_lines(text.splitlines(), [])
+    if metrics:
+        runs.append(metrics)
+    return runs
+
+
+def _parse_lines(lines, metrics):
+    """
+    Parse --metrics-brief ``lines`` continuing the open run ``metrics``.
+
+    A run ends at a metrics header or a 'dispatching hogs' line, which
+    start the next run, or at a 'run completed' line following its
+    metrics.
+
+    :returns: (list of completed runs, metrics of the open run)
+    """
+    runs = []
+    for line in lines:
+        if _RUN_START.search(line) or (metrics and _RUN_END.search(line)):
+            if metrics:
+                runs.append(metrics)
+            metrics = []
+            continue
+        match = _METRICS_LINE.match(line.strip())
+        if match:
+            metrics.append(Metric(match.group(1), int(match.group(2)),
+                                  *[float(value) for value in
+                                    match.groups()[2:]]))
+    return runs, metrics
+
+
+def parse_yaml(text):
+    """
+    Return the Metrics of a stress-ng --yaml file, or None if PyYAML is
+    not installed.
+    """
+    yaml = _import_yaml()
+    if yaml is None:
+        return None
+    try:
+        document = yaml.safe_load(text)
+    except yaml.YAMLError as exc:
+        _LOGGER.debug('Incomplete stress-ng YAML: %s', exc)
+        return []
+    metrics = []
+    for entry in (document or {}).get('metrics') or []:
+        try:
+            metrics.append(Metric(
+                str(entry['stressor']), int(entry['bogo-ops']),
+                float(entry.get('wall-clock-time', 'nan')),
+                float(entry.get('user-time', 'nan')),
+                float(entry.get('system-time', 'nan')),
+                float(entry['bogo-ops-per-second-real-time']),
+                float(entry.get('bogo-ops-per-second-usr-sys-time',
+                                'nan'))))
+        except (KeyError, TypeError, ValueError) as exc:
+            _LOGGER.debug('Skipping stress-ng metrics %r: %s', entry, exc)
+    return metrics
+
+
+def archive(shared_dir, archive_dir, patterns=DEFAULT_PATTERNS):
+    """
+    Copy the metrics files of ``shared_dir`` to ``archive_dir``, keeping
+    their modification times.
+
+    :returns: list of the copied files
+    """
+    copied = []
+    for name in _matching(shared_dir, patterns):
+        if not copied:
+            os.makedirs(archive_dir, exist_ok=True)
+        target = os.path.join(archive_dir, name)
+        try:
+            shutil.copy2(os.path.join(shared_dir, name), target)
+        except OSError as exc:
+            _LOGGER.warning('Failed to archive %s: %s', name, exc)
+            continue
+        copied.append(target)
+    return copied
+
+
+def _matching(directory, patterns):
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return []
+    return [name for name in names
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns) and
+            os.path.isfile(os.path.join(directory, name))]
+
+
+class Harvester(object):
+    """
+    Collect stress-ng runs from the shared dirs of the VMs.
+
+    ``runs`` maps every VM name to its list of Runs in the order they
+    were found.
+    """
+    def __init__(self, dirs, interval=5.0, patterns=DEFAULT_PATTERNS):
+        """
+        :param dirs: dict mapping names, e.g. WL<n>, to the directories
+            searched for metrics files, in order; a file found in more
+            than one of them is read once. Instead of a list, a function
+            returning (instance, directory) pairs may be given, see
+            QemuVM.harvest_dirs; a file is then read once per instance.
+        :param interval: Seconds between collections of the
+            harvesting thread
+        :param patterns: Shell patterns of the metrics files
+        """
+        self.dirs = dict((name, paths if callable(paths) else list(paths))
+                         for name, paths in dirs.items())
+        self.interval = float(interval)
+        self.patterns = tuple(patterns)
+        self.runs = dict((name, []) for name in self.dirs)
+        self._seen = dict((name, {}) for name in self.dirs)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_vms(cls, vms, interval=5.0, patterns=DEFAULT_PATTERNS):
+        """
+        Create a harvester for the shared and archive dirs of QemuVMs;
+        the VM of index n is named WL<n>.
+        """
+        return cls(dict(('WL%d' % index, vm.harvest_dirs)
+                        for index, vm in enumerate(vms)),
+                   interval, patterns)
+
+    def start(self):
+        """
+        Collect every ``interval`` seconds from a background thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='harvester')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the harvesting thread and collect once more.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.collect(final=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.collect()
+
+    def collect(self, final=False):
+        """
+        Read new and changed metrics files of all VMs.
+
+        :param final: the files are complete, e.g. after the VMs
+            stopped; open runs are ended and YAML files are read
+            without waiting for them to stay unchanged
+        :returns: number of runs found
+        """
+        found = 0
+        with self._lock:
+            for name in self.dirs:
+                now = time.time()
+                for instance, directory in self._sources(name):
+                    for filename in _matching(directory, self.patterns):
+                        runs = self._read(name, instance, directory,
+                                          filename, final, now)
+                        self.runs[name].extend(runs)
+                        found += len(runs)
+                if final:
+                    for (instance, _), state in self._seen[name].items():
+                        if state.get('metrics'):
+                            self.runs[name].append(Run(
+                                state['time'], state['path'],
+                                state['metrics'], state['mtime'], instance))
+                            state['metrics'] = []
+                            found += 1
+        return found
+
+    def _sources(self, name):
+        paths = self.dirs[name]
+        if callable(paths):
+            return paths()
+        return [(None, path) for path in paths]
+
+    def _read(self, name, instance, directory, filename, final, now):
+        path = os.path.join(directory, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return []
+        state = self._seen[name].setdefault(
+            (instance, filename),
+            {'offset': 0, 'metrics': [], 'stat': None, 'counted': None,
+             'time': None, 'mtime': None, 'path': path,
+             'instance': instance})
+        if os.path.splitext(filename)[1] in ('.yaml', '.yml'):
+            return self._read_yaml(path, stat, state, final, now)
+        return self._read_text(path, stat, state, now)
+
+    @staticmethod
+    def _read_yaml(path, stat, state, final, now):
+        current = (stat.st_mtime, stat.st_size)
+        if current == state['counted']:
+            return []
+        previous, state['stat'] = state['stat'], current
+        if current != previous and not final:
+            # still being written; read once it stays unchanged
+            return []
+        try:
+            with open(path, 'rb') as file_:
+                data = file_.read().decode('utf-8', 'replace')
+        except OSError as exc:
+            _LOGGER.debug('Failed to read %s: %s', path, exc)
+            return []
+        metrics = parse_yaml(data)
+        if metrics is None or metrics:
+            state['counted'] = current
+        return ([Run(now, path, metrics, stat.st_mtime, state['instance'])]
+                if metrics else [])
+
+    @staticmethod
+    def _read_text(path, stat, state, now):
+        if stat.st_size < state['offset']:
+            # truncated or replaced, read it from the start
+            state['offset'] = 0
+            state['metrics'] = []
+        if stat.st_size == state['offset']:
+            return []
+        try:
+            with open(path, 'rb') as file_:
+                file_.seek(state['offset'])
+                data = file_.read()
+        except OSError as exc:
+            _LOGGER.debug('Failed to read %s: %s', path, exc)
+            return []
+        # leave an unterminated last line for the next read
+        complete = data.rfind(b'\n') + 1
+        state['offset'] += complete
+        runs, state['metrics'] = _parse_lines(
+            data[:complete].decode('utf-8', 'replace').splitlines(),
+            state['metrics'])
+        state['time'] = now
+        state['mtime'] = stat.st_mtime
+        state['path'] = path
+        return [Run(now, path, metrics, stat.st_mtime, state['instance'])
+                for metrics in runs]
+
+    def series(self, name):
+        """
+        Return the runs of ``name`` ordered by time.
+        """
+        with self._lock:
+            return sorted(self.runs[name], key=lambda run: run.time)
+
+    def throughput(self, name, since=None, until=None, stressors=None):
+        """
+        Return the mean bogo-ops per second (real time) of the runs of
+        ``name`` which were found between the host times ``since`` and
+        ``until``; the rates of all stressors of a run are added up.
+
+        :param stressors: Stressors to count, None for all
+        :returns: float, NaN if there was no run
+        """
+        rates = []
+        for run in self.series(name):
+            if since is not None and run.time < since:
+                continue
+            if until is not None and run.time > until:
+                continue
+            rates.append(sum(metric.ops_per_sec for metric in run.metrics
+                             if stressors is None or
+                             metric.stressor in stressors))
+        return sum(rates) / len(rates) if rates else float('nan')
+
+    def run_length(self, name):
+        """
+        Return the real time in seconds of the last run of ``name``, or
+        None if there was no run yet.
+        """
+        runs = self.series(name)
+        if not runs:
+            return None
+        times = [metric.real_time for metric in runs[-1].metrics
+                 if metric.real_time == metric.real_time]
+        return max(times) if times else None
+
+    def summary(self):
+        """
+        Return the number of runs and the mean, min and max bogo-ops per
+        second of every stressor of every VM.
+        """
+        result = {}
+        for name in self.dirs:
+            stressors = {}
+            for run in self.series(name):
+                for metric in run.metrics:
+                    stressors.setdefault(metric.stressor, []).append(
+                        metric.ops_per_sec)
+            result[name] = dict(
+                (stressor, {'runs': len(rates),
+                            'mean': sum(rates) / len(rates),
+                            'min': min(rates), 'max': max(rates)})
+                for stressor, rates in stressors.items())
+        return result
+
+    def save(self, path):
+        """
+        Write all runs of all VMs to the JSON file ``path``.
+        """
+        with open(path, 'w') as file_:
+            json.dump(dict((name, [{'time': run.time, 'mtime': run.mtime,
+                                    'instance': run.instance,
+                                    'source': run.source,
+                                    'metrics': [metric._asdict()
+                                                for metric in run.metrics]}
+                                   for run in self.series(name)])
+                           for name in self.dirs),
+                      file_, indent=4, sort_keys=True)
+        _LOGGER.info('stress-ng metrics saved to %s', path)
+
+
+def measure(harvester, stressors=None):
+    """
+    Return a tuner measurement function which waits for the given
+    duration and reports the throughput of the stress-ng runs which
+    were found in the meantime, see Harvester.throughput.
+
+    The guest has to run stress-ng repeatedly with a --timeout shorter
+    than the measured duration, see Tuner ``min_slice``; a workload
+    without a finished run is reported as NaN.
+    """
+    def measure_runs(workloads, duration):
+        for name in workloads:
+            length = harvester.run_length(name)
+            if length and length >= duration:
+                _LOGGER.warning('stress-ng runs of %s take %.0f s, longer '
+                                'than the measured %.0f s; increase '
+                                'TUNER_MIN_SLICE', name, length, duration)
+        harvester.collect()
+        since = time.time()
+        time.sleep(duration)
+        harvester.collect()
+        results = {}
+        for name in workloads:
+            results[name] = harvester.throughput(name, since,
+                                                 stressors=stressors)
+            if math.isnan(results[name]):
+                _LOGGER.warning('No stress-ng run of %s finished within %s '
+                                'seconds', name, duration)
+        return results
+    return measure_runs
@@ -0,0 +1,189 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""Buffered, rotating log files for the console output of processes.
+
+``LogSink`` is a file-like object to be used as ``logfile`` of a pexpect
+child. Writes are collected in memory and written in batches, the file
+is rotated by size and age, optionally gzip compressed on the fly, and
+the last lines are kept in memory so they can be shown without reading
+the file back.
+"""
+
+import collections
+import gzip
+import os
+import threading
+import time
+
+from conf import settings as S
+
+
+class LogSink(object):
+    """
+    File-like sink writing batched text to a rotating log file.
+
+    ``flush`` only writes once LOG_FLUSH_BYTES are pending or
+    LOG_FLUSH_INTERVAL has passed since the last write to disk, as
+    pexpect calls it after every read; ``sync`` always writes.
+    """
+    def __init__(self, path, max_bytes=0, max_age=0, backups=5,
+                 compress=False, flush_bytes=65536, flush_interval=1.0,
+                 tail_lines=200):
+        """
+        :param path: Path of the log file; '.gz' is appended if compressed
+        :param max_bytes: Rotate once the file holds this many bytes of
+            text, 0 for no size limit
+        :param max_age: Rotate once the file is this many seconds old,
+            0 for no age limit
+        :param backups: Number of rotated files kept as <path>.1 ... <path>.N
+            (<path>.N.gz if compressed)
+        :param compress: Write gzip compressed files
+        :param flush_bytes: Pending bytes which trigger a write to disk
+        :param flush_interval: Seconds after which pending text is written
+        :param tail_lines: Number of last lines kept in memory
+        """
+        self.path = path + '.gz' if compress else path
+        self.max_bytes = int(max_bytes)
+        self.max_age = float(max_age)
+        self.backups = int(backups)
+        self.compress = compress
+        self.flush_bytes = int(flush_bytes)
+        self.flush_interval = float(flush_interval)
+        self._tail = collections.deque(maxlen=int(tail_lines) or None)
+        self._partial = ''
+        self._pending = []
+        self._pending_bytes = 0
+        self._file = None
+        self._size = 0
+        self._opened = 0
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        self._open()
+
+    @classmethod
+    def from_settings(cls, path):
+        """
+        Create a sink for ``path`` configured by the LOG_ROTATE_*,
+        LOG_COMPRESS, LOG_FLUSH_* and LOG_TAIL_LINES settings.
+        """
+        return cls(path,
+                   max_bytes=S.getValue('LOG_ROTATE_BYTES'),
+                   max_age=S.getValue('LOG_ROTATE_SECONDS'),
+                   backups=S.getValue('LOG_ROTATE_BACKUPS'),
+                   compress=S.getValue('LOG_COMPRESS'),
+                   flush_bytes=S.getValue('LOG_FLUSH_BYTES'),
+                   flush_interval=S.getValue('LOG_FLUSH_INTERVAL'),
+                   tail_lines=S.getValue('LOG_TAIL_LINES'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        """True once the sink is closed."""
+        return self._file is None
+
+    def write(self, text):
+        """
+        Queue ``text`` for writing.
+        """
+        if not text:
+            return
+        with self._lock:
+            if self._file is None:
+                raise ValueError('I/O operation on closed log sink')
+            self._pending.append(text)
+            self._pending_bytes += len(text)
+            lines = (self._partial + text).split('\n')
+            self._partial = lines.pop()
+            self._tail.extend(line.rstrip('\r') for line in lines)
+            if self._due():
+                self._write_pending()
+
+    def flush(self):
+        """
+        Write pending text if a flush is due.
+        """
+        with self._lock:
+            if self._file is not None and self._due():
+                self._write_pending()
+
+    def sync(self):
+        """
+        Write all pending text to disk.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._write_pending()
+
+    def close(self):
+        """
+        Write all pending text and close the file.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._write_pending()
+                self._file.close()
+                self._file = None
+
+    def tail(self, lines=None):
+        """
+        Return the last ``lines`` lines of output, including an
+        unterminated last line.
+        """
+        with self._lock:
+            result = list(self._tail)
+            if self._partial:
+                result.append(self._partial.rstrip('\r'))
+        return result[-lines:] if lines else result
+
+    def _due(self):
+        return (self._pending_bytes >= self.flush_bytes or
+                time.monotonic() - self._flushed >= self.flush_interval)
+
+    def _open(self):
+        if self.compress:
+            self._file = gzip.open(self.path, 'wt')
+        else:
+            self._file = open(self.path, 'w')
+        self._size = 0
+        self._opened = time.monotonic()
+
+    def _write_pending(self):
+        self._flushed = time.monotonic()
+        if not self._pending:
+            return
+        if self._rotation_due():
+            self._rotate()
+        data = ''.join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def _rotation_due(self):
+        if not self._size:
+            return False
+        if self.max_bytes and self._size + self._pending_bytes > self.max_bytes:
+            return True
+        return bool(self.max_age and
+                    time.monotonic() - self._opened >= self.max_age)
+
+    def _rotate(self):
+        self._file.close()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                source = self._backup(index)
+                if os.path.exists(source):
+                    os.replace(source, self._backup(index + 1))
+            os.replace(self.path, self._backup(1))
+        self._open()
+
+    def _backup(self, index):
+        if self.compress:
+            return '%s.%d.gz' % (self.path[:-len('.gz')], index)
+        return '%s.%d' % (self.path, index)
@@ -0,0 +1,155 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""Minimal client for the QEMU Machine Protocol (QMP).
+
+Keeps one connection to the QMP unix socket of a QEMU instance open, so
+monitor commands do not need a new process or connection each, and
+returns their results as structured data.
+"""
+
+import collections
+import json
+import logging
+import socket
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_EVENTS = 1000
+
+
+class QmpError(Exception):
+    """
+    Error returned by QEMU for a QMP command.
+    """
+    def __init__(self, command, error_class, desc):
+        super(QmpError, self).__init__('%s: %s: %s' %
+                                       (command, error_class, desc))
+        self.command = command
+        self.error_class = error_class
+        self.desc = desc
+
+
+class QmpClient(object):
+    """
+    Persistent connection to the QMP socket of a QEMU instance.
+
+    The last asynchronous events received while waiting for command
+    results are kept in ``events``.
+    """
+    def __init__(self, path, timeout=10, max_events=DEFAULT_MAX_EVENTS):
+        """
+        :param path: Path of the QMP unix socket
+        :param timeout: Seconds to wait for a reply
+        :param max_events: Number of events kept in ``events``
+        """
+        self._path = path
+        self._timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+        self.greeting = None
+        self.events = collections.deque(maxlen=int(max_events) or None)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def is_connected(self):
+        """
+        Returns True if the connection is open.
+        """
+        return self._sock is not None
+
+    def connect(self):
+        """
+        Connect to the socket and enter command mode.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        try:
+            sock.connect(self._path)
+        except (OSError, socket.timeout):
+            sock.close()
+            raise
+        self._sock = sock
+        self._file = sock.makefile('rb')
+        try:
+            self.greeting = self._read_message()
+            if 'QMP' not in self.greeting:
+                raise QmpError('connect', 'ProtocolError',
+                               'unexpected greeting %s' % self.greeting)
+            self.command('qmp_capabilities')
+        except Exception:
+            self.close()
+            raise
+        _LOGGER.debug('Connected to QMP socket %s', self._path)
+
+    def close(self):
+        """
+        Close the connection.
+        """
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def command(self, name, **arguments):
+        """
+        Run QMP command ``name`` with ``arguments``.
+
+        :returns: the ``return`` value of the command
+        :raises QmpError: if QEMU reports an error, or if the command
+            timed out or the connection failed; the connection is closed
+            then, so a late reply is never taken for the next command
+        """
+        request = {'execute': name}
+        if arguments:
+            request['arguments'] = arguments
+        with self._lock:
+            if not self._sock:
+                raise QmpError(name, 'ConnectionError', 'not connected')
+            try:
+                self._sock.sendall(json.dumps(request).encode('utf-8') +
+                                   b'\n')
+                return self._read_reply(name)
+            except socket.timeout:
+                self.close()
+                raise QmpError(name, 'Timeout', 'no reply within %s s' %
+                               self._timeout)
+            except OSError as exc:
+                self.close()
+                raise QmpError(name, 'ConnectionError', str(exc))
+
+    def _read_reply(self, name):
+        while True:
+            reply = self._read_message()
+            if 'event' in reply:
+                self.events.append(reply)
+                continue
+            if 'error' in reply:
+                raise QmpError(name, reply['error'].get('class'),
+                               reply['error'].get('desc'))
+            return reply.get('return')
+
+    def human_command(self, command_line):
+        """
+        Run a HMP command line, e.g. 'info cpus'.
+
+        :returns: the text output of the command
+        """
+        return self.command('human-monitor-command',
+                            **{'command-line': command_line})
+
+    def _read_message(self):
+        line = self._file.readline()
+        if not line:
+            self.close()
+            raise QmpError('read', 'ConnectionError',
+                           'connection closed by QEMU')
+        return json.loads(line.decode('utf-8'))
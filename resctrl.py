@@ -0,0 +1,454 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""Monitoring and cache allocation with resctrl groups of the Linux kernel.
+
+``ResctrlSampler`` periodically reads the LLC occupancy and the memory
+bandwidth (MBM) counters of resctrl groups from
+``<root>/<group>/mon_data/mon_L3_*/<event>`` into a preallocated NumPy
+ring buffer. MBM byte counters are turned into rates afterwards. The
+resctrl root is configurable, so the sampler also works on a fake
+directory tree.
+
+``ResctrlAllocator`` creates control groups owning the CPUs and an L3
+capacity bitmask of a workload by writing ``cpus_list`` and
+``schemata`` directly, without RMD.
+
+NumPy is only needed once a sampler is created.
+"""
+
+import glob
+import logging
+import os
+import threading
+import time
+
+import affinity
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_ROOT = '/sys/fs/resctrl'
+# directories of a resctrl group, which are no groups themselves
+_RESERVED = ('info', 'mon_groups', 'mon_data')
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError('NumPy is required for resctrl monitoring')
+    return numpy
+
+
+def read_value(path):
+    """
+    Return the content of a resctrl file stripped of whitespace, or None
+    if it cannot be read.
+    """
+    try:
+        with open(path) as file_:
+            return file_.read().strip()
+    except OSError:
+        return None
+
+
+def list_groups(root=DEFAULT_ROOT):
+    """
+    Return the paths of all resctrl groups below ``root``: the root
+    group, every control group and every monitoring group.
+    """
+    groups = [root] + _subdirs(root)
+    for parent in list(groups):
+        groups += _subdirs(os.path.join(parent, 'mon_groups'))
+    return groups
+
+
+def _subdirs(path):
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return []
+    return [os.path.join(path, name) for name in names
+            if name not in _RESERVED and
+            os.path.isdir(os.path.join(path, name))]
+
+
+def group_cpus(group):
+    """
+    Return the set of CPUs assigned to resctrl ``group``.
+    """
+    cpus = read_value(os.path.join(group, 'cpus_list'))
+    return affinity.parse_cpu_list(cpus) if cpus else set()
+
+
+def match_groups(cpumap, root=DEFAULT_ROOT):
+    """
+    Find the resctrl group of every workload.
+
+    The group whose ``cpus_list`` equals the cores of the workload is
+    preferred; otherwise the group holding most of its cores is used.
+    Workloads without any matching group are left out.
+
+    :param cpumap: dict mapping WL<n> to its cores
+    :returns: dict mapping WL<n> to the path of its group
+    """
+    groups = [(group, group_cpus(group)) for group in list_groups(root)]
+    result = {}
+    for name, cores in sorted(cpumap.items()):
+        cores = affinity.parse_cpu_list(list(cores))
+        best, best_overlap = None, 0
+        # the root group owns all unassigned CPUs, so it is only used if
+        # no other group matches
+        for group, cpus in groups[1:] + groups[:1]:
+            if cpus == cores:
+                best = group
+                break
+            if len(cpus & cores) > best_overlap:
+                best, best_overlap = group, len(cpus & cores)
+        if best is None:
+            _LOGGER.warning('No resctrl group found for %s (cores %s)', name,
+                            affinity.format_cpu_list(cores))
+            continue
+        result[name] = best
+    return result
+
+
+def cpu_cache_domains(cpus, sysfs='/sys/devices/system/cpu'):
+    """
+    Return the L3 cache domain id of every CPU in ``cpus``.
+
+    CPUs without L3 cache information are left out.
+    """
+    result = {}
+    for cpu in cpus:
+        for index in glob.glob(os.path.join(sysfs, 'cpu%d' % int(cpu), 'cache',
+                                            'index*')):
+            if read_value(os.path.join(index, 'level')) != '3':
+                continue
+            domain = read_value(os.path.join(index, 'id'))
+            if domain is not None and domain.isdigit():
+                result[int(cpu)] = int(domain)
+    return result
+
+
+def event_files(group, event):
+    """
+    Return the files of monitoring ``event`` of ``group``, one per L3
+    cache domain.
+    """
+    return sorted(glob.glob(os.path.join(group, 'mon_data', 'mon_L3_*',
+                                         event)))
+
+
+class ResctrlSampler(object):
+    """
+    Sample monitoring events of resctrl groups into a ring buffer.
+
+    ``times`` holds the sample timestamps and ``values`` the event
+    values summed over all L3 domains, shaped (capacity, groups, events).
+    Unreadable values, e.g. 'Unavailable', are stored as NaN.
+    """
+    EVENTS = ('llc_occupancy', 'mbm_total_bytes', 'mbm_local_bytes')
+    # events which are byte counters rather than levels
+    COUNTERS = ('mbm_total_bytes', 'mbm_local_bytes')
+    # highest plausible bandwidth in bytes per second; a decrease which
+    # would need more to be a wraparound is taken as a counter reset
+    MAX_RATE = 2.0 ** 40
+
+    def __init__(self, groups, interval=1.0, capacity=3600, cpus=None,
+                 events=None, counter_width=64):
+        """
+        :param groups: dict mapping names, e.g. WL<n>, to group paths
+        :param interval: Seconds between samples of the sampling thread
+        :param capacity: Number of samples kept
+        :param cpus: CPUs to pin the sampling thread to
+        :param events: Monitoring events to sample, defaults to EVENTS
+        :param counter_width: Width in bits of the MBM counters; a
+            decreasing counter is taken as a wraparound at this width
+        """
+        numpy = _import_numpy()
+        self.names = sorted(groups)
+        self.groups = dict(groups)
+        self.events = tuple(events or self.EVENTS)
+        self.interval = float(interval)
+        self.capacity = int(capacity)
+        self.counter_width = int(counter_width)
+        self._cpus = cpus
+        self.times = numpy.zeros(self.capacity)
+        self.values = numpy.full((self.capacity, len(self.names),
+                                  len(self.events)), numpy.nan)
+        self.count = 0
+        self._files = [[event_files(self.groups[name], event)
+                        for event in self.events] for name in self.names]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        for name, files in zip(self.names, self._files):
+            for event, paths in zip(self.events, files):
+                if not paths:
+                    _LOGGER.warning('%s: no %s data in %s', name, event,
+                                    self.groups[name])
+
+    def start(self):
+        """
+        Sample every ``interval`` seconds from a background thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='resctrl-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the sampling thread.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        if self._cpus:
+            affinity.pin_threads([(threading.get_native_id(), self._cpus)])
+        next_sample = time.monotonic()
+        while not self._stop.is_set():
+            self.sample()
+            next_sample += self.interval
+            self._stop.wait(max(next_sample - time.monotonic(), 0))
+
+    def sample(self):
+        """
+        Read all events of all groups once and store them.
+        """
+        numpy = _import_numpy()
+        row = numpy.zeros(self.values.shape[1:])
+        for group_index, files in enumerate(self._files):
+            for event_index, paths in enumerate(files):
+                for path in paths:
+                    value = read_value(path)
+                    try:
+                        row[group_index, event_index] += int(value)
+                    except (TypeError, ValueError):
+                        row[group_index, event_index] = float('nan')
+                if not paths:
+                    row[group_index, event_index] = float('nan')
+        with self._lock:
+            self.values[self.count % self.capacity] = row
+            self.times[self.count % self.capacity] = time.time()
+            self.count += 1
+
+    def series(self, event='llc_occupancy'):
+        """
+        Return the kept samples of ``event`` in chronological order.
+
+        :returns: (timestamps, values) arrays; values are shaped
+            (samples, groups) in the order of ``names``
+        """
+        numpy = _import_numpy()
+        event_index = self.events.index(event)
+        with self._lock:
+            count = self.count
+            if count <= self.capacity:
+                order = numpy.arange(count)
+            else:
+                order = numpy.roll(numpy.arange(self.capacity),
+                                   -(count % self.capacity))
+            # fancy indexing copies, so the rows cannot change afterwards
+            return self.times[order], self.values[order, :, event_index]
+
+    def rates(self, event='mbm_total_bytes'):
+        """
+        Return the rate of counter ``event`` between consecutive samples.
+
+        Counter deltas are computed for all samples and groups at once.
+        A negative delta is corrected by the counter width if the
+        resulting rate is at most MAX_RATE, otherwise the counter was
+        reset, e.g. by removing and recreating the group, and the rate
+        is NaN. The counters are summed over the L3 domains, so a
+        wraparound is corrected as long as at most one domain wraps per
+        interval.
+
+        :returns: (timestamps, rates) arrays; rates are in units per
+            second, shaped (samples - 1, groups), timestamps are the end
+            of every interval
+        """
+        numpy = _import_numpy()
+        times, values = self.series(event)
+        if len(times) < 2:
+            return times[:0], values[:0]
+        deltas = numpy.diff(values, axis=0)
+        intervals = numpy.diff(times)[:, numpy.newaxis]
+        wrapped = deltas < 0
+        deltas[wrapped] += float(2 ** self.counter_width)
+        rates = deltas / intervals
+        rates[wrapped & ~(rates <= self.MAX_RATE)] = numpy.nan
+        return times[1:], rates
+
+    def summary(self):
+        """
+        Return the last, mean and max value of every event per group.
+
+        Counters are reported as rates in bytes per second under their
+        event name with '_bytes' replaced by '_rate', e.g. mbm_total_rate.
+
+        :returns: dict mapping every name to {event: {'last', 'mean',
+            'max'}}; values are None if no valid sample was taken
+        """
+        numpy = _import_numpy()
+        result = dict((name, {}) for name in self.names)
+        for event in self.events:
+            if event in self.COUNTERS:
+                _, values = self.rates(event)
+                key = event.replace('_bytes', '_rate')
+            else:
+                _, values = self.series(event)
+                key = event
+            for index, name in enumerate(self.names):
+                column = values[:, index]
+                valid = column[~numpy.isnan(column)]
+                if not valid.size:
+                    result[name][key] = {'last': None, 'mean': None,
+                                         'max': None}
+                    continue
+                result[name][key] = {'last': _number(column[-1]),
+                                     'mean': float(valid.mean()),
+                                     'max': float(valid.max())}
+        return result
+
+
+def _number(value):
+    return None if value != value else float(value)
+
+
+def parse_schemata(text):
+    """
+    Parse the content of a resctrl ``schemata`` file.
+
+    :returns: dict mapping every resource, e.g. 'L3', to a dict mapping
+        the cache domain ids to their value strings
+    """
+    result = {}
+    for line in text.splitlines():
+        resource, _, domains = line.strip().partition(':')
+        if not domains:
+            continue
+        result[resource.strip()] = dict(
+            (int(domain), value.strip()) for domain, _, value in
+            (item.partition('=') for item in domains.split(';')))
+    return result
+
+
+def format_schemata(resource, masks):
+    """
+    Format the ``schemata`` line of ``resource`` for capacity bitmasks.
+
+    :param masks: dict mapping cache domain ids to integer bitmasks
+    """
+    return '%s:%s\n' % (resource, ';'.join(
+        '%d=%x' % (domain, masks[domain]) for domain in sorted(masks)))
+
+
+class ResctrlAllocator(object):
+    """
+    Cache allocation through resctrl control groups.
+
+    Every allocation is a control group named with ``prefix``, owning a
+    set of CPUs and an L3 capacity bitmask (CBM) on every cache domain.
+    """
+    def __init__(self, root=DEFAULT_ROOT, prefix='rmdtester-',
+                 resource='L3'):
+        """
+        :param root: Mount point of the resctrl filesystem
+        :param prefix: Name prefix of the groups created
+        :param resource: Cache resource to allocate, 'L3' or e.g. 'L3CODE'
+        """
+        self.root = root
+        self.prefix = prefix
+        self.resource = resource
+        info = os.path.join(root, 'info', resource)
+        cbm_mask = read_value(os.path.join(info, 'cbm_mask'))
+        if not cbm_mask:
+            raise RuntimeError('No %s cache allocation support in %s' %
+                               (resource, root))
+        self.cbm_mask = int(cbm_mask, 16)
+        self.ways = bin(self.cbm_mask).count('1')
+        self.min_cbm_bits = int(read_value(os.path.join(info, 'min_cbm_bits'))
+                                or 1)
+        self.domains = sorted(self.schemata(root))
+
+    def schemata(self, group):
+        """
+        Return the capacity bitmasks of ``group`` by cache domain.
+        """
+        text = read_value(os.path.join(group, 'schemata')) or ''
+        return dict((domain, int(value, 16)) for domain, value in
+                    parse_schemata(text).get(self.resource, {}).items())
+
+    def groups(self):
+        """
+        Return the paths of the groups created with ``prefix``.
+        """
+        return [group for group in _subdirs(self.root)
+                if os.path.basename(group).startswith(self.prefix)]
+
+    def create_group(self, name, cpus, masks):
+        """
+        Create group ``prefix + name`` owning ``cpus``.
+
+        :param masks: dict mapping cache domain ids to bitmasks, or one
+            bitmask for all cache domains
+        :returns: path of the group
+        :raises RuntimeError: if the group cannot be set up; a partly
+            created group is removed again
+        """
+        group = os.path.join(self.root, self.prefix + name)
+        try:
+            os.mkdir(group)
+        except FileExistsError:
+            raise RuntimeError('resctrl group %s already exists' % group)
+        except OSError as exc:
+            raise RuntimeError('Cannot create resctrl group %s: %s' %
+                               (group, exc))
+        try:
+            if not isinstance(masks, dict):
+                masks = dict((domain, masks) for domain in self.domains)
+            self.write_schemata(group, masks)
+            _write(os.path.join(group, 'cpus_list'),
+                   affinity.format_cpu_list(affinity.parse_cpu_list(cpus)))
+        except RuntimeError:
+            self.remove_group(group)
+            raise
+        return group
+
+    def write_schemata(self, group, masks):
+        """
+        Set the capacity bitmasks of ``group``.
+        """
+        _write(os.path.join(group, 'schemata'),
+               format_schemata(self.resource, masks))
+
+    @staticmethod
+    def remove_group(group):
+        """
+        Remove ``group``; its CPUs return to the root group.
+
+        :returns: True if the group was removed, False if it did not exist
+        :raises RuntimeError: if the group cannot be removed
+        """
+        try:
+            os.rmdir(group)
+        except FileNotFoundError:
+            return False
+        except OSError as exc:
+            raise RuntimeError('Cannot remove resctrl group %s: %s' %
+                               (group, exc))
+        return True
+
+
+def _write(path, text):
+    try:
+        with open(path, 'w') as file_:
+            file_.write(text)
+    except OSError as exc:
+        raise RuntimeError('Cannot write %r to %s: %s' %
+                           (text.strip(), path, exc))
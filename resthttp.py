@@ -14,18 +14,25 @@
 
 '''
 @author Spirent Communications
-Client class and exception for performing basic ReST API interactions.
+Client classes and exception for performing basic ReST API interactions.
 
 '''
 
 from __future__ import print_function
 
+import asyncio
 import base64
+import concurrent.futures
+import functools
+import hashlib
 import os
 import sys
 import json
 import requests
 
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 0
+
 
 class RestHttpError(Exception):
 
@@ -96,7 +103,8 @@ class RestHttp(object):
     """
 
     def __init__(self, base_url, user=None, password=None, ssl_verify=True,
-                 debug_print=False):
+                 debug_print=False, pool_size=DEFAULT_POOL_SIZE,
+                 keep_alive=True, max_retries=DEFAULT_MAX_RETRIES):
         """Initialize the ReST API HTTP wrapper object.
 
         Arguments:
@@ -105,6 +113,10 @@ class RestHttp(object):
         password    -- Optional password for basic auth.
         ssl_verify  -- Set to False to disable SSL verification (not secure).
         debug_print -- Enable debug print statements.
+        pool_size   -- Maximum number of pooled connections to base_url.
+        keep_alive  -- Set to False to close the connection after each
+                       request instead of returning it to the pool.
+        max_retries -- Number of retries for failed connection attempts.
 
         """
         self._base_url = base_url.strip('/')
@@ -120,6 +132,27 @@ class RestHttp(object):
             b64string = base64.encodestring('%s:%s' % (user, password))[:-1]
             self._base_headers["Authorization"] = "Basic %s" % b64string
 
+        if not keep_alive:
+            self._base_headers['Connection'] = 'close'
+
+        # all verb methods share one session, so TCP connections to the
+        # server are reused instead of being opened for every request
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=int(pool_size),
+                                                max_retries=int(max_retries))
+        self._session.mount(self._base_url + '/', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections."""
+        self._session.close()
+
     @staticmethod
     def url(proto, server, port=None, uri=None):
         """Construct a URL from the given components."""
@@ -187,8 +220,8 @@ class RestHttp(object):
         headers = self._make_headers(None)
 
         try:
-            rsp = requests.head(url, headers=self._base_headers,
-                                verify=self._verify)
+            rsp = self._session.head(url, headers=self._base_headers,
+                                     verify=self._verify)
         except requests.exceptions.ConnectionError as e:
             RestHttp._raise_conn_error(e)
 
@@ -208,8 +241,8 @@ class RestHttp(object):
             query_items = None
 
         try:
-            rsp = requests.get(url, query_items, headers=headers,
-                               verify=self._verify)
+            rsp = self._session.get(url, query_items, headers=headers,
+                                    verify=self._verify)
         except requests.exceptions.ConnectionError as e:
             RestHttp._raise_conn_error(e)
 
@@ -218,14 +251,53 @@ class RestHttp(object):
 
         return self._handle_response(rsp, to_lower)
 
+    def conditional_get(self, container, resource=None, etag=None,
+                        accept=None):
+        """Send a GET request answered only if the resource has changed.
+
+        The entity tag of the previous response is sent in If-None-Match.
+        If the server does not return entity tags, a hash of the response
+        body is used as the tag instead, so an unchanged body is not
+        decoded again.
+
+        Returns (status, data, etag).  The status is 304 and data is None
+        if the resource did not change.
+
+        """
+        url = self.make_url(container, resource)
+        headers = self._make_headers(accept)
+        if etag:
+            headers = dict(headers)
+            headers['If-None-Match'] = etag
+
+        try:
+            rsp = self._session.get(url, headers=headers, verify=self._verify)
+        except requests.exceptions.ConnectionError as e:
+            RestHttp._raise_conn_error(e)
+
+        if self._dbg_print:
+            self.__print_req('GET', rsp.url, headers, None)
+
+        if rsp.status_code == 304:
+            return rsp.status_code, None, etag
+
+        rsp_etag = rsp.headers.get('ETag')
+        if not rsp_etag and rsp.status_code < 300:
+            rsp_etag = '"sha1-%s"' % hashlib.sha1(rsp.content).hexdigest()
+            if rsp_etag == etag:
+                return 304, None, etag
+
+        status, data = self._handle_response(rsp)
+        return status, data, rsp_etag
+
     def post_request(self, container, resource=None, params=None, accept=None):
         """Send a POST request."""
         url = self.make_url(container, resource)
         headers = self._make_headers(accept)
 
         try:
-            rsp = requests.post(url, data=json.dumps(params), headers=headers,
-                                verify=self._verify)
+            rsp = self._session.post(url, data=json.dumps(params),
+                                     headers=headers, verify=self._verify)
         except requests.exceptions.ConnectionError as e:
             RestHttp._raise_conn_error(e)
 
@@ -240,8 +312,8 @@ class RestHttp(object):
         headers = self._make_headers(accept)
 
         try:
-            rsp = requests.put(url, params, headers=headers,
-                               verify=self._verify)
+            rsp = self._session.put(url, params, headers=headers,
+                                    verify=self._verify)
         except requests.exceptions.ConnectionError as e:
             RestHttp._raise_conn_error(e)
 
@@ -261,8 +333,8 @@ class RestHttp(object):
             query_items = None
 
         try:
-            rsp = requests.delete(url, params=query_items, headers=headers,
-                                  verify=self._verify)
+            rsp = self._session.delete(url, params=query_items,
+                                       headers=headers, verify=self._verify)
         except requests.exceptions.ConnectionError as e:
             RestHttp._raise_conn_error(e)
 
@@ -285,8 +357,8 @@ class RestHttp(object):
             query_items = None
 
         try:
-            rsp = requests.get(url, query_items, headers=headers, stream=True,
-                               verify=self._verify)
+            rsp = self._session.get(url, query_items, headers=headers,
+                                    stream=True, verify=self._verify)
         except requests.exceptions.ConnectionError as e:
             RestHttp._raise_conn_error(e)
 
@@ -335,8 +407,8 @@ class RestHttp(object):
             url = self.make_url(container, None, None)
         with open(src_file_path, 'rb') as up_file:
             try:
-                rsp = requests.request(method, url, headers=headers,
-                                       data=up_file)
+                rsp = self._session.request(method, url, headers=headers,
+                                            data=up_file)
             except requests.exceptions.ConnectionError as e:
                 RestHttp._raise_conn_error(e)
 
@@ -356,7 +428,7 @@ class RestHttp(object):
         with open(src_file_path, 'rb') as up_file:
             files = {'file': (dst_name, up_file, content_type)}
             try:
-                rsp = requests.post(url, headers=headers, files=files)
+                rsp = self._session.post(url, headers=headers, files=files)
             except requests.exceptions.ConnectionError as e:
                 RestHttp._raise_conn_error(e)
 
@@ -377,7 +449,7 @@ class RestHttp(object):
                 multi_files.append(
                     ('files', (dst_name, open(src_path, 'rb'), content_type)))
 
-            rsp = requests.post(url, headers=headers, files=multi_files)
+            rsp = self._session.post(url, headers=headers, files=multi_files)
         except requests.exceptions.ConnectionError as e:
             RestHttp._raise_conn_error(e)
         finally:
@@ -494,3 +566,79 @@ class RestHttp(object):
         if params:
             print('  --- Params ---')
             print('   ', params)
+
+
+class AsyncRestHttp(object):
+
+    """
+    Asyncio counterpart of the RestHttp client.
+
+    Each request is run by the wrapped RestHttp object on a private thread
+    pool, so coroutines share its pooled connections and at most
+    ``concurrency`` requests are in flight at the same time.
+
+    """
+
+    def __init__(self, rest, concurrency=DEFAULT_POOL_SIZE):
+        """Initialize the asyncio ReST API wrapper object.
+
+        Arguments:
+        rest        -- RestHttp object used to perform the requests.
+        concurrency -- Maximum number of concurrent requests.  Should not
+                       exceed the connection pool size of ``rest``.
+
+        """
+        self._rest = rest
+        self._concurrency = int(concurrency)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._concurrency)
+
+    def rest(self):
+        """Return the wrapped RestHttp object."""
+        return self._rest
+
+    def concurrency(self):
+        """Return the maximum number of concurrent requests."""
+        return self._concurrency
+
+    def close(self):
+        """Stop the request threads and close all pooled connections."""
+        self.shutdown()
+        self._rest.close()
+
+    def shutdown(self):
+        """Stop the request threads, leaving the wrapped client open."""
+        self._executor.shutdown(wait=True)
+
+    async def head_request(self, *args, **kwargs):
+        """Send a HEAD request."""
+        return await self._run(self._rest.head_request, *args, **kwargs)
+
+    async def get_request(self, *args, **kwargs):
+        """Send a GET request."""
+        return await self._run(self._rest.get_request, *args, **kwargs)
+
+    async def conditional_get(self, *args, **kwargs):
+        """Send a GET request answered only if the resource has changed."""
+        return await self._run(self._rest.conditional_get, *args, **kwargs)
+
+    async def post_request(self, *args, **kwargs):
+        """Send a POST request."""
+        return await self._run(self._rest.post_request, *args, **kwargs)
+
+    async def put_request(self, *args, **kwargs):
+        """Send a PUT request."""
+        return await self._run(self._rest.put_request, *args, **kwargs)
+
+    async def delete_request(self, *args, **kwargs):
+        """Send a DELETE request."""
+        return await self._run(self._rest.delete_request, *args, **kwargs)
+
+    ###########################################################################
+    # private methods
+    #
+
+    async def _run(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(method, *args, **kwargs))
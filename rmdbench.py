@@ -0,0 +1,241 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""Benchmark of the RMD ReST client.
+
+Measures ``IrmdHttp.setup_cacheways``, ``IrmdHttp.reset_all_cacheways``
+and ``IrmdHttp.log_allocations`` for a range of workload counts and
+request concurrency levels, either against the configured RMD server or
+against a local ``rmdemulator``. Throughput and latency percentiles of
+every operation are written to a JSON file, so runs of different commits
+can be compared. Throughput and latency count successful calls only;
+failed calls are reported as ``errors`` and ``error_rate``.
+
+Examples::
+
+    python rmdbench.py --emulate --latency 0.002 --workloads 1,4,16 \\
+        --concurrency 1,4,16 --repeat 20 --output bench.json
+    python rmdbench.py --server 127.0.0.1 --port 8081 --output rmd.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+import resthttp
+import rmdemulator
+import rmdtester
+import systeminfo
+from conf import settings as S
+
+_LOGGER = logging.getLogger(__name__)
+_CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(samples, pct):
+    """
+    Return the ``pct`` percentile of ``samples``, interpolating linearly
+    between the closest ranks.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(operation, workloads, concurrency, samples, items, errors=0,
+              elapsed=None):
+    """
+    Build the result record of one benchmarked operation.
+
+    :param samples: Latency of every successful call in seconds
+    :param items: Number of workloads processed by every call
+    :param errors: Number of failed calls
+    :param elapsed: Seconds spent in all calls, including the failed
+        ones; defaults to the sum of ``samples``
+    """
+    total = sum(samples)
+    if elapsed is None:
+        elapsed = total
+    calls = len(samples) + errors
+    result = {'operation': operation,
+              'workloads': workloads,
+              'concurrency': concurrency,
+              'calls': calls,
+              'errors': errors,
+              'error_rate': float(errors) / calls if calls else None,
+              'throughput': (items * len(samples) / elapsed if elapsed
+                             else None),
+              'latency': {'min': min(samples) if samples else None,
+                          'mean': total / len(samples) if samples else None,
+                          'max': max(samples) if samples else None}}
+    for pct in PERCENTILES:
+        result['latency']['p%d' % pct] = percentile(samples, pct)
+    return result
+
+
+def bench_point(server, port, api_version, workloads, concurrency, repeat):
+    """
+    Benchmark all operations for one workload count and concurrency.
+
+    :returns: list of result records
+    """
+    affinity_map = {}
+    for index in range(workloads):
+        cos_cat = 'WL%d' % index
+        affinity_map[cos_cat] = [str(index)]
+        S.setValue(cos_cat + '_CA', [1, 1])
+    S.setValue('POLICY_TYPE', 'CUSTOM')
+
+    irmd = rmdtester.IrmdHttp(server, port, api_version,
+                              pool_size=concurrency, debug_print=False)
+    async_irmd = rmdtester.AsyncIrmdHttp(irmd, concurrency)
+    if concurrency > 1:
+        setup = lambda: asyncio.run(async_irmd.setup_cacheways(affinity_map))
+    else:
+        setup = lambda: irmd.setup_cacheways(affinity_map)
+    operations = (('setup_cacheways', setup, workloads),
+                  ('log_allocations', irmd.log_allocations, 1),
+                  ('reset_all_cacheways', irmd.reset_all_cacheways,
+                   workloads))
+    timings = dict((name, []) for name, _, _ in operations)
+    errors = dict((name, 0) for name, _, _ in operations)
+    elapsed = dict((name, 0.0) for name, _, _ in operations)
+    try:
+        for _ in range(repeat):
+            for name, operation, _ in operations:
+                start = time.perf_counter()
+                try:
+                    operation()
+                except (RuntimeError, OSError, resthttp.ConnectionError,
+                        resthttp.RestHttpError) as exc:
+                    errors[name] += 1
+                    _LOGGER.debug('%s failed: %s', name, exc)
+                else:
+                    timings[name].append(time.perf_counter() - start)
+                elapsed[name] += time.perf_counter() - start
+    finally:
+        if irmd.workloadids:
+            irmd.reset_all_cacheways(raise_on_error=False)
+        async_irmd.shutdown()
+        irmd.close()
+
+    return [summarize(name, workloads, concurrency, timings[name], items,
+                      errors[name], elapsed[name])
+            for name, _, items in operations]
+
+
+def run(server, port, api_version, workload_counts, concurrency_levels,
+        repeat):
+    """
+    Benchmark every combination of workload count and concurrency.
+
+    :returns: list of result records
+    """
+    results = []
+    for workloads in workload_counts:
+        for concurrency in concurrency_levels:
+            _LOGGER.info('Benchmarking %d workloads, concurrency %d',
+                         workloads, concurrency)
+            results.extend(bench_point(server, port, api_version, workloads,
+                                       concurrency, repeat))
+    return results
+
+
+def print_results(results):
+    """
+    Print the results as a table.
+    """
+    print('%-20s %9s %11s %12s %8s %10s %10s %10s' %
+          ('operation', 'workloads', 'concurrency', 'throughput/s',
+           'errors %', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for result in results:
+        print('%-20s %9d %11d %12s %8s %10s %10s %10s' %
+              (result['operation'], result['workloads'],
+               result['concurrency'],
+               _format(result['throughput'], '%.1f'),
+               _format(result['error_rate'], '%.1f', 100),
+               _format(result['latency']['p50'], '%.2f', 1000),
+               _format(result['latency']['p95'], '%.2f', 1000),
+               _format(result['latency']['p99'], '%.2f', 1000)))
+
+
+def _format(value, fmt, scale=1):
+    return '-' if value is None else fmt % (value * scale)
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the RMD client')
+    parser.add_argument('--server', default=None,
+                        help='RMD server, defaults to RMD_SERVER_IP')
+    parser.add_argument('--port', type=int, default=None,
+                        help='RMD port, defaults to RMD_PORT')
+    parser.add_argument('--api-version', default=None,
+                        help='RMD API version, defaults to RMD_API_VERSION')
+    parser.add_argument('--emulate', action='store_true',
+                        help='benchmark against a local RMD emulator')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='emulator response delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='emulator probability of injected errors')
+    parser.add_argument('--workloads', type=_int_list, default=[1, 4, 16],
+                        help='comma separated workload counts')
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 4, 16],
+                        help='comma separated concurrency levels')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='calls per operation and point')
+    parser.add_argument('--output', default='rmdbench.json',
+                        help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    S.load_from_dir(_CURR_DIR)
+    server = args.server or str(S.getValue('RMD_SERVER_IP'))
+    port = args.port or int(S.getValue('RMD_PORT'))
+    api_version = args.api_version or str(S.getValue('RMD_API_VERSION'))
+
+    emulator = None
+    if args.emulate:
+        emulator = rmdemulator.RmdEmulator(
+            port=0, api_version=api_version,
+            cache_ways=max(args.workloads + [rmdemulator.DEFAULT_CACHE_WAYS]),
+            latency=args.latency, error_rate=args.error_rate)
+        emulator.start()
+        server, port = emulator.server, emulator.port
+
+    try:
+        results = run(server, port, api_version, args.workloads,
+                      args.concurrency, args.repeat)
+    finally:
+        if emulator:
+            emulator.stop()
+
+    report = {'meta': {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                       'git_tag': systeminfo.get_git_tag(_CURR_DIR),
+                       'server': server,
+                       'port': port,
+                       'api_version': api_version,
+                       'emulated': args.emulate,
+                       'emulator_latency': args.latency if args.emulate
+                                           else None,
+                       'repeat': args.repeat},
+              'results': results}
+    with open(args.output, 'w') as file_:
+        json.dump(report, file_, indent=4, sort_keys=True)
+    print_results(results)
+    print('Results written to %s' % args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""Local stand-in for the Intel RMD ReST API.
+
+Implements the ``/<version>/workloads`` GET/POST/DELETE calls used by
+``rmdtester.IrmdHttp``, so clients can be exercised on any Linux box
+without RMD or CAT capable hardware. Response latency, injected server
+errors and the cache-way capacity are configurable.
+
+Run standalone with::
+
+    python rmdemulator.py --port 8081 --latency 0.005 --error-rate 0.01
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CACHE_WAYS = 11
+
+# min/max cache ways of the class of service policies known to RMD
+DEFAULT_POLICIES = {
+    'gold': {'min_cache': 6, 'max_cache': 6},
+    'silver-bf': {'min_cache': 2, 'max_cache': 4},
+    'bronze-shared': {'min_cache': 1, 'max_cache': 2},
+}
+
+
+class EmulatorError(Exception):
+    """
+    Error returned to the client with the given HTTP status.
+    """
+    def __init__(self, status, message):
+        super(EmulatorError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RmdState(object):
+    """
+    Workload bookkeeping of the emulated RMD daemon.
+
+    Every workload reserves its ``min_cache`` ways; a workload is refused
+    once the reserved ways would exceed the cache capacity.
+    """
+    def __init__(self, cache_ways=DEFAULT_CACHE_WAYS, policies=None):
+        self.cache_ways = int(cache_ways)
+        self.policies = policies or DEFAULT_POLICIES
+        self._workloads = {}
+        self._next_id = 1
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def list_workloads(self):
+        """
+        Return all workloads ordered by id.
+        """
+        return self.snapshot()[1]
+
+    def snapshot(self):
+        """
+        Return the entity tag of the workload list and the list itself.
+        """
+        with self._lock:
+            return ('"%d"' % self._generation,
+                    [dict(self._workloads[wl_id])
+                     for wl_id in sorted(self._workloads, key=int)])
+
+    def get_workload(self, wl_id):
+        """
+        Return workload ``wl_id``.
+        """
+        with self._lock:
+            if wl_id not in self._workloads:
+                raise EmulatorError(404, 'workload %s not found' % wl_id)
+            return dict(self._workloads[wl_id])
+
+    def create_workload(self, params):
+        """
+        Validate ``params`` and create a new workload.
+        """
+        if not isinstance(params, dict):
+            raise EmulatorError(400, 'Bad request, invalid workload')
+        core_ids = [str(core) for core in params.get('core_ids') or []]
+        task_ids = [str(task) for task in params.get('task_ids') or []]
+        if not core_ids and not task_ids:
+            raise EmulatorError(400, 'Bad request, core_ids or task_ids '
+                                'must be given')
+
+        if params.get('policy'):
+            policy = params['policy'].lower()
+            if policy not in self.policies:
+                raise EmulatorError(400, 'Bad request, unknown policy %s' %
+                                    params['policy'])
+            min_cache = self.policies[policy]['min_cache']
+            max_cache = self.policies[policy]['max_cache']
+        else:
+            policy = None
+            try:
+                min_cache = int(params['min_cache'])
+                max_cache = int(params['max_cache'])
+            except (KeyError, TypeError, ValueError):
+                raise EmulatorError(400, 'Bad request, policy or '
+                                    'min_cache/max_cache must be given')
+            if min_cache < 1 or min_cache > max_cache:
+                raise EmulatorError(400, 'Bad request, invalid cache '
+                                    'range [%d, %d]' % (min_cache, max_cache))
+        if max_cache > self.cache_ways:
+            raise EmulatorError(400, 'Bad request, max_cache %d exceeds '
+                                'cache capacity %d' %
+                                (max_cache, self.cache_ways))
+
+        with self._lock:
+            for workload in self._workloads.values():
+                used = (set(workload['core_ids']) & set(core_ids) or
+                        set(workload['task_ids']) & set(task_ids))
+                if used:
+                    raise EmulatorError(
+                        400, 'Bad request, workload with %s already exists' %
+                        ','.join(sorted(used)))
+            reserved = sum(workload['min_cache']
+                           for workload in self._workloads.values())
+            if reserved + min_cache > self.cache_ways:
+                raise EmulatorError(
+                    500, 'Not enough cache: %d of %d ways available' %
+                    (self.cache_ways - reserved, self.cache_ways))
+
+            wl_id = str(self._next_id)
+            self._next_id += 1
+            workload = {'id': wl_id,
+                        'core_ids': core_ids,
+                        'task_ids': task_ids,
+                        'policy': policy,
+                        'min_cache': min_cache,
+                        'max_cache': max_cache,
+                        'cos_name': '%s-%s' % (wl_id, policy or 'custom'),
+                        'status': 'Successful'}
+            self._workloads[wl_id] = workload
+            self._generation += 1
+            return dict(workload)
+
+    def delete_workload(self, wl_id):
+        """
+        Remove workload ``wl_id``.
+        """
+        with self._lock:
+            if wl_id not in self._workloads:
+                raise EmulatorError(404, 'workload %s not found' % wl_id)
+            del self._workloads[wl_id]
+            self._generation += 1
+
+
+class _RmdHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the emulated RMD ReST API.
+    """
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; without TCP_NODELAY every
+    # kept-alive response would stall on the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin
+        _LOGGER.debug('%s - %s', self.address_string(), format % args)
+
+    def _dispatch(self, method):
+        emulator = self.server.emulator
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        emulator.delay()
+        try:
+            if emulator.inject_fault():
+                raise EmulatorError(500, 'Injected fault')
+            status, data, etag = emulator.handle(method, self.path, body)
+        except EmulatorError as exc:
+            status, data, etag = exc.status, {'message': exc.message}, None
+        if etag and etag == self.headers.get('If-None-Match'):
+            self._reply(304, None, etag)
+        else:
+            self._reply(status, data, etag)
+
+    def _reply(self, status, data, etag=None):
+        payload = json.dumps(data).encode('utf-8') if status != 304 else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class RmdEmulator(object):
+    """
+    Emulated RMD server running on a localhost port.
+
+    Can be used as a context manager; the server is served from a
+    background thread between ``start`` and ``stop``.
+    """
+    def __init__(self, server='127.0.0.1', port=0, api_version='v1',
+                 cache_ways=DEFAULT_CACHE_WAYS, latency=0.0, jitter=0.0,
+                 error_rate=0.0, policies=None, seed=None, etags=True):
+        """
+        :param server: Address to listen on
+        :param port: Port to listen on, 0 picks a free port
+        :param api_version: API version prefix of the URLs
+        :param cache_ways: Number of L3 cache ways available to workloads
+        :param latency: Delay in seconds added to every response
+        :param jitter: Maximum random delay in seconds added on top
+        :param error_rate: Probability of answering a request with an
+            injected 500 error
+        :param policies: Mapping of COS policy names to min/max cache
+        :param seed: Seed of the latency and fault generator
+        :param etags: Tag the workload list with an ETag and answer
+            matching If-None-Match requests with 304
+        """
+        self.state = RmdState(cache_ways, policies)
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.error_rate = float(error_rate)
+        self.etags = etags
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._path = re.compile(r'^/%s/workloads/?(?:([^/?]+)/?)?(?:\?.*)?$' %
+                                re.escape(api_version.strip('/')))
+        self._httpd = ThreadingHTTPServer((server, int(port)), _RmdHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.emulator = self
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.stop()
+
+    @property
+    def server(self):
+        """Address the emulator listens on."""
+        return self._httpd.server_address[0]
+
+    @property
+    def port(self):
+        """Port the emulator listens on."""
+        return self._httpd.server_address[1]
+
+    def start(self):
+        """
+        Serve requests from a background thread.
+        """
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        name='rmdemulator')
+        self._thread.daemon = True
+        self._thread.start()
+        _LOGGER.info('RMD emulator listening on %s:%d', self.server,
+                     self.port)
+
+    def serve_forever(self):
+        """
+        Serve requests from the calling thread.
+        """
+        self._httpd.serve_forever()
+
+    def stop(self):
+        """
+        Stop serving and close the listening socket.
+        """
+        if self._thread:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def delay(self):
+        """
+        Sleep for the configured response latency.
+        """
+        delay = self.latency
+        if self.jitter:
+            with self._random_lock:
+                delay += self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def inject_fault(self):
+        """
+        Return True if the current request should fail.
+        """
+        if self.error_rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    def handle(self, method, path, body):
+        """
+        Run a ReST call against the emulated state.
+
+        :returns: (http status, response data, entity tag or None)
+        """
+        match = self._path.match(path)
+        if not match:
+            raise EmulatorError(404, 'Not found: %s' % path)
+        wl_id = match.group(1)
+
+        if method == 'GET':
+            if wl_id:
+                return 200, self.state.get_workload(wl_id), None
+            etag, workloads = self.state.snapshot()
+            return 200, workloads, etag if self.etags else None
+        if method == 'POST' and not wl_id:
+            try:
+                params = json.loads(body.decode('utf-8') or 'null')
+            except ValueError:
+                raise EmulatorError(400, 'Bad request, invalid JSON')
+            return 200, self.state.create_workload(params), None
+        if method == 'DELETE' and wl_id:
+            self.state.delete_workload(wl_id)
+            return 200, {}, None
+        raise EmulatorError(405, 'Method %s not allowed on %s' %
+                            (method, path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulated Intel RMD server')
+    parser.add_argument('--server', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--api-version', default='v1')
+    parser.add_argument('--cache-ways', type=int, default=DEFAULT_CACHE_WAYS)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='maximum random delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='probability of an injected 500 error')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    emulator = RmdEmulator(args.server, args.port, args.api_version,
+                           args.cache_ways, args.latency, args.jitter,
+                           args.error_rate, seed=args.seed)
+    _LOGGER.info('RMD emulator listening on %s:%d', emulator.server,
+                 emulator.port)
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,202 @@
 # Copyright 2017-2018 Spirent Communications.
 
+import abc
+import asyncio
+import asynctasks
+import cacheplan
+import harvest
 import hashlib
 import json
 import logging
 import os
 import re
+import resctrl
 import resthttp
+import scenario
 import socket
+import stat
+import systeminfo
 import tasks
-import subprocess
-import locale
+import time
+import pexpect
+import qmp
 from conf import settings as S
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 _LOGGER = logging.getLogger(__name__)
 _CURR_DIR = os.path.dirname(os.path.realpath(__file__))
 DEFAULT_PORT = 8888
 DEFAULT_SERVER = '127.0.0.1'
 DEFAULT_VERSION = 'v1'
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TEARDOWN_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.1
+DEFAULT_RETRY_BACKOFF_MAX = 2.0
+TEARDOWN_DELETED = 'deleted'
+TEARDOWN_ABSENT = 'absent'
+TEARDOWN_FAILED = 'failed'
+
+
+def workload_params(affinity_map):
+    """
+    Build the RMD workload request parameters for each entry of
+    ``affinity_map`` from the configured cache allocation policy.
+
+    Stops at the first workload without a complete [min, max] pair.
+    """
+    workloads = []
+    for cos_cat in affinity_map:
+        if S.getValue('POLICY_TYPE') == 'COS':
+            params = {'core_ids': affinity_map[cos_cat],
+                      'policy': S.getValue(cos_cat + '_COS')}
+        else:
+            minmax = S.getValue(cos_cat + '_CA')
+            if len(minmax) < 2:
+                break
+            params = {'core_ids': affinity_map[cos_cat],
+                      'min_cache': minmax[0],
+                      'max_cache': minmax[1]}
+        workloads.append(params)
+    return workloads
+
+
+def validate_workload_params(affinity_map):
+    """
+    Check the cache allocation policy of every workload in
+    ``affinity_map`` before anything is sent to RMD.
+
+    :returns: list of RMD workload request parameters
+    :raises RuntimeError: listing every problem found in the map
+    """
+    errors = []
+    policy_type = S.getValue('POLICY_TYPE')
+    if policy_type not in ('COS', 'CUSTOM'):
+        raise RuntimeError('Unknown POLICY_TYPE %r' % policy_type)
+
+    workloads = []
+    owners = {}
+    for cos_cat in affinity_map:
+        cores = [str(core) for core in affinity_map[cos_cat]]
+        if not cores:
+            errors.append('%s has no cores' % cos_cat)
+        for core in cores:
+            if not core.isdigit():
+                errors.append('%s: invalid core id %r' % (cos_cat, core))
+            elif core in owners:
+                errors.append('%s: core %s is already used by %s' %
+                              (cos_cat, core, owners[core]))
+            else:
+                owners[core] = cos_cat
+
+        if policy_type == 'COS':
+            try:
+                policy = S.getValue(cos_cat + '_COS')
+            except AttributeError:
+                policy = None
+            if not policy or not isinstance(policy, str):
+                errors.append('%s_COS is not defined' % cos_cat)
+                continue
+            params = {'core_ids': affinity_map[cos_cat], 'policy': policy}
+        else:
+            try:
+                minmax = S.getValue(cos_cat + '_CA')
+            except AttributeError:
+                minmax = None
+            if (not isinstance(minmax, (list, tuple)) or len(minmax) != 2 or
+                    not all(isinstance(val, int) for val in minmax)):
+                errors.append('%s_CA must be a [min_cache, max_cache] pair' %
+                              cos_cat)
+                continue
+            if not 0 < minmax[0] <= minmax[1]:
+                errors.append('%s_CA: expected 0 < min_cache <= max_cache, '
+                              'got %s' % (cos_cat, minmax))
+                continue
+            params = {'core_ids': affinity_map[cos_cat],
+                      'min_cache': minmax[0],
+                      'max_cache': minmax[1]}
+        workloads.append(params)
+
+    if errors:
+        raise RuntimeError('Invalid cache allocation: ' + '; '.join(errors))
+    return workloads
+
+
+def raise_post_error(exp):
+    """
+    Translate an error returned for a workload POST.
+    """
+    if str(exp).find('already exists') >= 0:
+        raise RuntimeError("The cacheway already exist")
+    raise RuntimeError('Failed to connect: ' + str(exp))
+
+
+def cache_range(params):
+    """
+    Return the (min, max) cache ways of workload request ``params``;
+    COS policies are looked up in COS_POLICIES.
+    """
+    if 'policy' not in params:
+        return params['min_cache'], params['max_cache']
+    policy = _cos_policy(params['policy'])
+    return policy['min_cache'], policy['max_cache']
+
+
+def _cos_policy(name):
+    policies = S.getValue('COS_POLICIES')
+    if name.lower() not in policies:
+        raise RuntimeError('Unknown COS policy %s, see COS_POLICIES' % name)
+    return policies[name.lower()]
+
+
+def plan_workloads(affinity_map, ways, domains=(0,), min_cbm_bits=1,
+                   cpu_domains=None, skip_unknown=False):
+    """
+    Plan the cache ways of every workload in ``affinity_map`` offline,
+    see cacheplan.plan, in CACHE_PLAN_MODE keeping CACHE_PLAN_RESERVED
+    ways for the rest of the system.
+
+    :param ways: Number of L3 cache ways per cache domain
+    :param domains: Ids of all cache domains
+    :param min_cbm_bits: Minimum number of ways of an allocation
+    :param cpu_domains: dict mapping cores to their cache domain; cores
+        not in it are taken to be on the first domain
+    :param skip_unknown: leave workloads of a COS policy missing in
+        COS_POLICIES out of the plan instead of raising
+    :returns: cacheplan.Plan
+    :raises RuntimeError: if the parameters are invalid or do not fit
+        into the cache (cacheplan.InfeasibleError)
+    """
+    workloads = validate_workload_params(affinity_map)
+    cpu_domains = cpu_domains or {}
+    requirements = []
+    for cos_cat, params in zip(affinity_map, workloads):
+        if (skip_unknown and 'policy' in params and
+                params['policy'].lower() not in S.getValue('COS_POLICIES')):
+            _LOGGER.warning('%s: COS policy %s not in COS_POLICIES, not '
+                            'planned', cos_cat, params['policy'])
+            continue
+        min_ways, max_ways = cache_range(params)
+        exclusive = ('policy' in params and
+                     _cos_policy(params['policy']).get('exclusive', False))
+        requirements.append(cacheplan.Requirement(
+            cos_cat, min_ways, max_ways,
+            sorted(set(cpu_domains.get(int(core), domains[0])
+                       for core in params['core_ids'])), exclusive))
+    return cacheplan.plan(requirements, ways, domains,
+                          S.getValue('CACHE_PLAN_MODE'), min_cbm_bits,
+                          S.getValue('CACHE_PLAN_RESERVED'))
 
 
 class IrmdHttp(object):
     """
     Intel RMD ReST API wrapper object
     """
-    def __init__(self, server=None, port=None, api_version=None):
+    def __init__(self, server=None, port=None, api_version=None,
+                 pool_size=resthttp.DEFAULT_POOL_SIZE, keep_alive=True,
+                 max_retries=resthttp.DEFAULT_MAX_RETRIES, debug_print=True,
+                 teardown_retries=DEFAULT_TEARDOWN_RETRIES,
+                 retry_backoff=DEFAULT_RETRY_BACKOFF,
+                 retry_backoff_max=DEFAULT_RETRY_BACKOFF_MAX):
         if not port:
             server = DEFAULT_SERVER
         if not port:
@@ -32,7 +204,9 @@ class IrmdHttp(object):
         if not api_version:
             api_version = DEFAULT_VERSION
         url = resthttp.RestHttp.url('http', server, port, api_version)
-        rest = resthttp.RestHttp(url, None, None, False, True)
+        rest = resthttp.RestHttp(url, None, None, False, debug_print,
+                                 pool_size=pool_size, keep_alive=keep_alive,
+                                 max_retries=max_retries)
         try:
             rest.get_request('workloads')
         except (socket.error, resthttp.ConnectionError,
@@ -40,24 +214,21 @@ class IrmdHttp(object):
             raise RuntimeError('Cannot connect to RMD server: %s:%s' %
                                (server, port))
         self._rest = rest
+        self._pool_size = int(pool_size)
+        self.teardown_retries = int(teardown_retries)
+        self.retry_backoff = float(retry_backoff)
+        self.retry_backoff_max = float(retry_backoff_max)
         self.workloadids = []
+        self._allocations = None
+        self._allocations_etag = None
+        self._async = None
         self._logger = logging.getLogger(__name__)
 
     def setup_cacheways(self, affinity_map):
         """
         Sets up the cacheways using RMD apis.
         """
-        for cos_cat in affinity_map:
-            if S.getValue('POLICY_TYPE') == 'COS':
-                params = {'core_ids': affinity_map[cos_cat],
-                          'policy': S.getValue(cos_cat + '_COS')}
-            else:
-                minmax = S.getValue(cos_cat + '_CA')
-                if len(minmax) < 2:
-                    return
-                params = {'core_ids': affinity_map[cos_cat],
-                          'min_cache': minmax[0],
-                          'max_cache': minmax[1]}
+        for params in workload_params(affinity_map):
             try:
                 _, data = self._rest.post_request('workloads', None,
                                                   params)
@@ -66,67 +237,685 @@ class IrmdHttp(object):
                     self.workloadids.append(wl_id)
 
             except resthttp.RestHttpError as exp:
-                if str(exp).find('already exists') >= 0:
-                    raise RuntimeError("The cacheway already exist")
-                else:
-                    raise RuntimeError('Failed to connect: ' + str(exp))
+                raise_post_error(exp)
 
-    def reset_all_cacheways(self):
+    def reset_all_cacheways(self, raise_on_error=True):
         """
         Resets the cacheways
+
+        All workloads are deleted concurrently, see
+        AsyncIrmdHttp.reset_all_cacheways. Callers running on an event
+        loop await ``async_client().reset_all_cacheways()`` instead.
+
+        :returns: dict with the teardown result of every workload id
+        :raises RuntimeError: if called from a running event loop
         """
         try:
-            for wl_id in self.workloadids:
-                self._rest.delete_request('workloads', str(wl_id))
-        except resthttp.RestHttpError as ecp:
-            raise RuntimeError('Failed to connect: ' + str(ecp))
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(
+                self.async_client().reset_all_cacheways(raise_on_error))
+        raise RuntimeError('reset_all_cacheways called from a running event '
+                           'loop, await async_client().reset_all_cacheways() '
+                           'instead')
+
+    def async_client(self):
+        """
+        Return the AsyncIrmdHttp sharing the connections of this object.
+
+        It is created on first use and kept until ``close``.
+        """
+        if self._async is None:
+            self._async = AsyncIrmdHttp(self, self._pool_size)
+        return self._async
 
-    def log_allocations(self):
+    def log_allocations(self, full=False):
         """
         Log the current cacheway settings.
+
+        The listing is cached and revalidated with its entity tag, so only
+        the workloads added, removed or changed since the previous call
+        are logged. The complete listing is logged on the first call or
+        if ``full`` is set.
+
+        :returns: dict with the added, removed and changed workloads
         """
         try:
-            _, data = self._rest.get_request('workloads')
+            status, data, etag = self._rest.conditional_get(
+                'workloads', etag=self._allocations_etag)
+        except resthttp.RestHttpError as ecp:
+            raise RuntimeError('Failed to connect: ' + str(ecp))
+        return self._update_allocations(status, data, etag, full)
+
+    def _update_allocations(self, status, data, etag, full):
+        if status == 304:
+            data = list(self._allocations.values())
+        else:
+            self._allocations_etag = etag
+        current = {}
+        for workload in data or []:
+            current[str(workload.get('id'))] = workload
+        previous = self._allocations
+        self._allocations = current
+
+        if previous is None:
+            previous = {}
+            full = True
+        diff = {'added': [current[wl_id] for wl_id in current
+                          if wl_id not in previous],
+                'removed': [previous[wl_id] for wl_id in previous
+                            if wl_id not in current],
+                'changed': [current[wl_id] for wl_id in current
+                            if wl_id in previous and
+                            current[wl_id] != previous[wl_id]]}
+
+        if full:
             self._logger.info("Current Allocations: %s",
                               json.dumps(data, indent=4, sort_keys=True))
+        elif any(diff.values()):
+            for change in ('added', 'removed', 'changed'):
+                for workload in diff[change]:
+                    self._logger.info("Allocation %s: %s", change,
+                                      json.dumps(workload, sort_keys=True))
+        else:
+            self._logger.debug("Allocations unchanged")
+        return diff
+
+    def close(self):
+        """
+        Close the pooled connections to the RMD server.
+        """
+        if self._async is not None:
+            self._async.shutdown()
+            self._async = None
+        self._rest.close()
+
+
+class AsyncIrmdHttp(object):
+    """
+    Asyncio variant of IrmdHttp, issuing workload requests concurrently.
+
+    Wraps an IrmdHttp object and shares its connection pool, teardown
+    retry settings and list of allocated workload ids.
+    """
+    def __init__(self, irmd, concurrency=DEFAULT_CONCURRENCY):
+        self._irmd = irmd
+        self._rest = resthttp.AsyncRestHttp(irmd._rest, concurrency)
+        self.teardown_retries = irmd.teardown_retries
+        self.retry_backoff = irmd.retry_backoff
+        self.retry_backoff_max = irmd.retry_backoff_max
+        self.workloadids = irmd.workloadids
+        self._logger = logging.getLogger(__name__)
+
+    async def setup_cacheways(self, affinity_map):
+        """
+        Sets up the cacheways using concurrent RMD api calls.
+        """
+        results = await asyncio.gather(
+            *[self._post_workload(params)
+              for params in workload_params(affinity_map)],
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    async def setup_cacheways_atomic(self, workloads):
+        """
+        Sets up all ``workloads`` as a single transaction.
+
+        No new workload is posted once one of them has failed; any error
+        of a request, including a reply without a workload id, counts as
+        a failure. The workloads created so far are then deleted
+        concurrently, and the first error is raised.
+        """
+        slots = asyncio.Semaphore(self._rest.concurrency())
+        created = []
+        failures = []
+
+        async def post(params):
+            async with slots:
+                if failures:
+                    return
+                try:
+                    data = await self._post_workload(params)
+                except Exception as exc:  # pylint: disable=broad-except
+                    failures.append(exc)
+                    return
+                if not isinstance(data, dict) or 'id' not in data:
+                    failures.append(RuntimeError(
+                        'RMD returned no workload id for %s: %r' %
+                        (params, data)))
+                    return
+                created.append(data['id'])
+
+        results = await asyncio.gather(
+            *[post(params) for params in workloads], return_exceptions=True)
+        failures.extend(result for result in results
+                        if isinstance(result, BaseException))
+        if failures:
+            await self.delete_workloads(created)
+            raise RuntimeError('Cache allocation rolled back: %s' %
+                               failures[0])
+
+    async def reset_all_cacheways(self, raise_on_error=True):
+        """
+        Resets the cacheways using concurrent RMD api calls.
+
+        Every workload id is tried, even if some of them fail; ids which
+        were removed are dropped from ``workloadids``.
+
+        :param raise_on_error: raise RuntimeError if any workload could
+            not be removed
+        :returns: dict with the teardown result of every workload id
+        """
+        report = await self.delete_workloads(list(self.workloadids))
+        failed = ['%s (%s)' % (wl_id, result['error'])
+                  for wl_id, result in report.items()
+                  if result['status'] == TEARDOWN_FAILED]
+        if failed and raise_on_error:
+            raise RuntimeError('Failed to remove workloads: ' +
+                               ', '.join(failed))
+        return report
+
+    async def delete_workloads(self, wl_ids):
+        """
+        Delete ``wl_ids`` concurrently.
+
+        Connection errors and server side errors are retried up to
+        ``teardown_retries`` times with exponential backoff. A workload
+        which RMD does not know anymore is treated as removed; any other
+        error fails only the workload it occurred for.
+
+        :returns: dict mapping each workload id to a dict with its
+            ``status`` (deleted, absent or failed), the number of
+            ``attempts`` and the last ``error``
+        """
+        results = await asyncio.gather(
+            *[self._delete_workload(wl_id) for wl_id in wl_ids],
+            return_exceptions=True)
+        report = dict(
+            (wl_id, {'status': TEARDOWN_FAILED, 'attempts': 1,
+                     'error': str(result) or type(result).__name__}
+             if isinstance(result, BaseException) else result)
+            for wl_id, result in zip(wl_ids, results))
+        for wl_id, result in report.items():
+            if result['status'] != TEARDOWN_FAILED:
+                if wl_id in self.workloadids:
+                    self.workloadids.remove(wl_id)
+            else:
+                self._logger.error('Failed to remove workload %s: %s',
+                                   wl_id, result['error'])
+        return report
+
+    async def log_allocations(self, full=False):
+        """
+        Log the changes of the cacheway settings, see
+        IrmdHttp.log_allocations.
+        """
+        try:
+            status, data, etag = await self._rest.conditional_get(
+                'workloads', etag=self._irmd._allocations_etag)
         except resthttp.RestHttpError as ecp:
             raise RuntimeError('Failed to connect: ' + str(ecp))
+        return self._irmd._update_allocations(status, data, etag, full)
 
+    def close(self):
+        """
+        Close the request threads and pooled connections.
+        """
+        self._rest.close()
 
-class CacheAllocator(object):
+    def shutdown(self):
+        """
+        Stop the request threads, keeping the connections of the wrapped
+        IrmdHttp open.
+        """
+        self._rest.shutdown()
+
+    async def _post_workload(self, params):
+        try:
+            _, data = await self._rest.post_request('workloads', None,
+                                                    params)
+        except resthttp.RestHttpError as exp:
+            raise_post_error(exp)
+        if isinstance(data, dict) and 'id' in data:
+            self.workloadids.append(data['id'])
+        return data
+
+    async def _delete_workload(self, wl_id):
+        retries = self.teardown_retries
+        delay = self.retry_backoff
+        max_delay = self.retry_backoff_max
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                await self._rest.delete_request('workloads', str(wl_id))
+                return {'status': TEARDOWN_DELETED, 'attempts': attempt,
+                        'error': None}
+            except resthttp.RestHttpError as exp:
+                if (exp.status() == 404 or
+                        str(exp).lower().find('not found') >= 0):
+                    return {'status': TEARDOWN_ABSENT, 'attempts': attempt,
+                            'error': None}
+                error = exp
+                transient = exp.status() >= 500 or exp.status() == 429
+            except resthttp.ConnectionError as exp:
+                error = exp
+                transient = True
+            if not transient or attempt > retries:
+                return {'status': TEARDOWN_FAILED, 'attempts': attempt,
+                        'error': str(error)}
+            await asyncio.sleep(min(delay * 2 ** (attempt - 1), max_delay))
+
+
+class AllocationBackend(abc.ABC):
     """
-    This class exposes APIs for VSPERF to perform
-    Cache-allocation management operations.
+    Interface of the cache allocation backends used by CacheAllocator.
+    """
+    name = None
+    # allocations are rejected if they do not fit the offline plan
+    enforce_plan = True
+
+    @abc.abstractmethod
+    def setup(self, affinity_map, atomic=None, plan=None):
+        """
+        Allocate the cache of every workload in ``affinity_map`` according
+        to POLICY_TYPE and the WL*_COS or WL*_CA settings.
+
+        :param atomic: remove the allocations already made again if any
+            workload fails
+        :param plan: cacheplan.Plan of the workloads, if already computed
+        """
+
+    def cache_geometry(self):
+        """
+        Return the L3 cache geometry of the host.
+
+        It is read from RESCTRL_ROOT if resctrl is mounted, else the
+        L3_CACHE_WAYS setting is used.
+
+        :returns: (ways, cache domain ids, min_cbm_bits) or None if
+            unknown
+        """
+        try:
+            allocator = resctrl.ResctrlAllocator(S.getValue('RESCTRL_ROOT'))
+            return allocator.ways, allocator.domains, allocator.min_cbm_bits
+        except RuntimeError:
+            pass
+        if S.getValue('L3_CACHE_WAYS'):
+            return int(S.getValue('L3_CACHE_WAYS')), [0], 1
+        return None
+
+    @abc.abstractmethod
+    def cleanup(self, raise_on_error=True):
+        """
+        Remove all allocations.
+
+        :returns: dict with the teardown result of every allocation
+        """
+
+    @abc.abstractmethod
+    def log_allocations(self, full=False):
+        """
+        Log the current allocations.
+        """
+
+    def close(self):
+        """
+        Release the resources held by the backend.
+        """
+
+
+class RmdBackend(AllocationBackend):
+    """
+    Allocation through the ReST API of the Intel RMD daemon.
     """
+    name = 'rmd'
 
     def __init__(self):
         port = S.getValue('RMD_PORT')
         api_version = S.getValue('RMD_API_VERSION')
         server_ip = S.getValue('RMD_SERVER_IP')
+        self.concurrency = int(S.getValue('RMD_CONCURRENCY'))
+        # keep a pooled connection for every concurrent request
+        pool_size = max(int(S.getValue('RMD_POOL_SIZE')), self.concurrency)
         self.irmd_manager = IrmdHttp(str(server_ip), str(port),
-                                     str(api_version))
+                                     str(api_version),
+                                     pool_size,
+                                     S.getValue('RMD_KEEP_ALIVE'),
+                                     S.getValue('RMD_MAX_RETRIES'),
+                                     teardown_retries=S.getValue(
+                                         'RMD_TEARDOWN_RETRIES'),
+                                     retry_backoff=S.getValue(
+                                         'RMD_RETRY_BACKOFF'),
+                                     retry_backoff_max=S.getValue(
+                                         'RMD_RETRY_BACKOFF_MAX'))
+        self.async_manager = AsyncIrmdHttp(self.irmd_manager,
+                                           max(self.concurrency, 1))
+        # RMD defines the policies and may share ways between workloads
+        self.enforce_plan = S.getValue('RMD_ENFORCE_PLAN')
+
+    def setup(self, affinity_map, atomic=None, plan=None):
+        """
+        Set up the cacheways of all workloads.
+
+        In atomic mode, RMD_BATCH_APPLY by default, the whole WL*_CA/WL*_COS
+        map is validated before any request is sent. If any workload cannot
+        be created, the ones already created are removed again, leaving RMD
+        as it was.
+        """
+        if atomic is None:
+            atomic = S.getValue('RMD_BATCH_APPLY')
+        if atomic:
+            workloads = validate_workload_params(affinity_map)
+            asyncio.run(self.async_manager.setup_cacheways_atomic(workloads))
+        elif self.concurrency > 1:
+            asyncio.run(self.async_manager.setup_cacheways(affinity_map))
+        else:
+            self.irmd_manager.setup_cacheways(affinity_map)
+
+    def cleanup(self, raise_on_error=True):
+        """
+        Remove all workloads created.
+
+        :returns: dict with the teardown result of every workload id
+        """
+        if self.concurrency > 1:
+            return asyncio.run(
+                self.async_manager.reset_all_cacheways(raise_on_error))
+        return self.irmd_manager.reset_all_cacheways(raise_on_error)
+
+    def log_allocations(self, full=False):
+        """
+        Log the workloads known to RMD.
+
+        :returns: dict with the added, removed and changed workloads
+        """
+        return self.irmd_manager.log_allocations(full)
+
+    def close(self):
+        self.async_manager.shutdown()
+        self.irmd_manager.close()
+
+
+class ResctrlBackend(AllocationBackend):
+    """
+    Allocation by writing resctrl control groups directly.
+
+    Every workload gets a group owning its cores with a contiguous block
+    of cache ways planned by plan_workloads; COS policies are mapped to
+    cache ways by COS_POLICIES. Ways not given to any workload are left
+    to the root group, so workloads do not share their ways with the
+    rest of the system.
+    """
+    name = 'resctrl'
+
+    def __init__(self, root=None):
+        self.allocator = resctrl.ResctrlAllocator(
+            root or S.getValue('RESCTRL_ROOT'))
+        self._root_masks = None
+        self._logger = logging.getLogger(__name__)
+
+    def setup(self, affinity_map, atomic=None, plan=None):
+        """
+        Create a resctrl group for every workload with the bitmasks
+        planned by plan_workloads.
+
+        The allocation is always atomic: if any group cannot be created,
+        the groups already created are removed again.
+        """
+        if plan is None:
+            plan = plan_workloads(affinity_map, *self.cache_geometry(),
+                                  cpu_domains=self.cpu_domains(affinity_map))
+        allocator = self.allocator
+        low = (allocator.cbm_mask & -allocator.cbm_mask).bit_length() - 1
+        created = []
+        # the root group is only restored on failure if this call
+        # restricted it, not while earlier allocations still exist
+        restrict_root = self._root_masks is None
+        try:
+            for name in affinity_map:
+                masks = dict((domain, mask << low) for domain, mask in
+                             plan.allocations[name].masks.items())
+                created.append(allocator.create_group(
+                    name, [int(core) for core in affinity_map[name]], masks))
+            self._restrict_root(dict((domain, mask << low) for domain, mask
+                                     in plan.free.items()))
+        except RuntimeError:
+            for group in created:
+                try:
+                    allocator.remove_group(group)
+                except RuntimeError as exc:
+                    self._logger.error('Rollback failed: %s', exc)
+            if restrict_root:
+                self._restore_root()
+            raise
+
+    def cache_geometry(self):
+        return (self.allocator.ways, self.allocator.domains,
+                self.allocator.min_cbm_bits)
+
+    @staticmethod
+    def cpu_domains(affinity_map):
+        """
+        Return the cache domain of every core in ``affinity_map``.
+        """
+        return resctrl.cpu_cache_domains(
+            [int(core) for cores in affinity_map.values() for core in cores])
+
+    def _restrict_root(self, free):
+        """
+        Leave only the ways in ``free`` to the root group, if they are
+        contiguous and enough.
+        """
+        allocator = self.allocator
+        for mask in free.values():
+            low = mask & -mask
+            if (bin(mask).count('1') < allocator.min_cbm_bits or
+                    mask & (mask + low)):
+                self._logger.warning('No contiguous cache ways left for the '
+                                     'root group, workloads share their ways '
+                                     'with it')
+                return
+        if self._root_masks is None:
+            self._root_masks = allocator.schemata(allocator.root)
+        allocator.write_schemata(allocator.root, free)
+
+    def _restore_root(self):
+        if self._root_masks:
+            self.allocator.write_schemata(self.allocator.root,
+                                          self._root_masks)
+        self._root_masks = None
+
+    def cleanup(self, raise_on_error=True):
+        """
+        Remove all groups created by rmdtester and restore the root group.
+
+        :returns: dict mapping each group name to a dict with its
+            ``status`` (deleted, absent or failed), the number of
+            ``attempts`` and the last ``error``
+        """
+        report = {}
+        for group in self.allocator.groups():
+            name = os.path.basename(group)
+            try:
+                removed = self.allocator.remove_group(group)
+                report[name] = {'status': TEARDOWN_DELETED if removed else
+                                          TEARDOWN_ABSENT,
+                                'attempts': 1, 'error': None}
+            except RuntimeError as exc:
+                self._logger.error('Failed to remove %s: %s', name, exc)
+                report[name] = {'status': TEARDOWN_FAILED, 'attempts': 1,
+                                'error': str(exc)}
+        self._restore_root()
+        failed = ['%s (%s)' % (name, result['error'])
+                  for name, result in report.items()
+                  if result['status'] == TEARDOWN_FAILED]
+        if failed and raise_on_error:
+            raise RuntimeError('Failed to remove resctrl groups: ' +
+                               ', '.join(failed))
+        return report
+
+    def log_allocations(self, full=False):
+        """
+        Log the cores and capacity bitmasks of every group.
+
+        :returns: dict mapping each group name to its cpus and schemata
+        """
+        allocations = {}
+        for group in [self.allocator.root] + self.allocator.groups():
+            name = os.path.basename(group)
+            allocations[name] = {
+                'cpus': resctrl.read_value(os.path.join(group, 'cpus_list')),
+                'schemata': dict((str(domain), '%x' % mask) for domain, mask
+                                 in self.allocator.schemata(group).items())}
+        self._logger.info("Current Allocations: %s",
+                          json.dumps(allocations, indent=4, sort_keys=True))
+        return allocations
+
+
+_BACKENDS = {'rmd': RmdBackend, 'resctrl': ResctrlBackend}
+
+
+class CacheAllocator(object):
+    """
+    This class exposes APIs for VSPERF to perform
+    Cache-allocation management operations.
+
+    The allocations are made by the backend selected with
+    ALLOCATION_BACKEND: 'rmd' (RmdBackend) or 'resctrl' (ResctrlBackend).
+    """
+
+    def __init__(self):
+        name = S.getValue('ALLOCATION_BACKEND')
+        if name not in _BACKENDS:
+            raise RuntimeError('Unknown ALLOCATION_BACKEND %r, expected one '
+                               'of %s' % (name, ', '.join(sorted(_BACKENDS))))
+        self.backend = _BACKENDS[name]()
+        self.sampler = None
 
     def setup_llc_allocation(self):
         """
         Wrapper for settingup cacheways
         """
-        cpumap = defaultdict(list)
-        for i in range(int(S.getValue('WL_VM_COUNT')) +
-                       int(S.getValue('WL_PROCESS_COUNT'))):
-            cpumap['WL' + str(i)] = S.getValue('WL_CORE_BINDING')[i]
-        self.irmd_manager.setup_cacheways(cpumap)
+        self.backend.setup(self._cpumap(), plan=self.plan_llc_allocation())
+
+    def setup_llc_allocation_batch(self):
+        """
+        Set up the cacheways of all workloads as one transaction.
+
+        The whole WL*_CA/WL*_COS map is validated before anything is
+        allocated. If any workload cannot be set up, the allocations
+        already made are removed again.
+        """
+        self.backend.setup(self._cpumap(), atomic=True,
+                           plan=self.plan_llc_allocation())
+
+    def plan_llc_allocation(self, strict=None):
+        """
+        Check offline that the cache allocation of all workloads fits
+        into the L3 cache of the host and log the planned ways.
+
+        Unless the plan is enforced, as by the resctrl backend, a
+        problem is only logged and workloads of a COS policy missing in
+        COS_POLICIES are left out of the plan.
+
+        :param strict: raise if the allocation does not fit the plan;
+            defaults to ``enforce_plan`` of the backend
+        :returns: cacheplan.Plan, or None if the cache geometry is
+            unknown, see AllocationBackend.cache_geometry, or the plan
+            failed without ``strict``
+        :raises RuntimeError: if ``strict`` and the allocation is invalid
+            or infeasible
+        """
+        if strict is None:
+            strict = self.backend.enforce_plan
+        geometry = self.backend.cache_geometry()
+        if not geometry:
+            _LOGGER.warning('L3 cache geometry unknown, set L3_CACHE_WAYS '
+                            'to check allocations before they are made')
+            return None
+        cpumap = self._cpumap()
+        try:
+            plan = plan_workloads(
+                cpumap, *geometry,
+                cpu_domains=ResctrlBackend.cpu_domains(cpumap),
+                skip_unknown=not strict)
+        except RuntimeError as exc:
+            if strict:
+                raise
+            _LOGGER.warning('%s; allocating it anyway', exc)
+            return None
+        plan.log(_LOGGER)
+        return plan
 
     def cleanup_llc_allocation(self):
         """
         Wrapper for cacheway cleanup
+
+        :returns: dict with the teardown result of every allocation
         """
-        self.irmd_manager.reset_all_cacheways()
+        return self.backend.cleanup()
 
-    def log_allocations(self):
+    def log_allocations(self, full=False):
         """
         Wrapper for logging cacheway allocations
         """
-        self.irmd_manager.log_allocations()
+        return self.backend.log_allocations(full)
+
+    def start_monitoring(self):
+        """
+        Start sampling the LLC occupancy and memory bandwidth of the
+        resctrl group of every workload every MONITOR_INTERVAL seconds.
+
+        The groups are looked up by the workload cores, so this must be
+        called after the allocation was set up.
+
+        :returns: the started resctrl.ResctrlSampler
+        """
+        groups = resctrl.match_groups(self._cpumap(),
+                                      S.getValue('RESCTRL_ROOT'))
+        if not groups:
+            raise RuntimeError('No resctrl group found for any workload in '
+                               '%s' % S.getValue('RESCTRL_ROOT'))
+        self.stop_monitoring()
+        self.sampler = resctrl.ResctrlSampler(
+            groups, S.getValue('MONITOR_INTERVAL'),
+            S.getValue('MONITOR_SAMPLES'), S.getValue('HOUSEKEEPING_CPUS'),
+            S.getValue('MONITOR_EVENTS'), S.getValue('MBM_COUNTER_WIDTH'))
+        self.sampler.start()
+        return self.sampler
+
+    def stop_monitoring(self):
+        """
+        Stop sampling and log the summary of every workload.
+
+        :returns: summary per workload, see ResctrlSampler.summary, or
+            None if monitoring was not started
+        """
+        if not self.sampler:
+            return None
+        self.sampler.stop()
+        summary = self.sampler.summary()
+        for name in sorted(summary):
+            for event, stats in sorted(summary[name].items()):
+                _LOGGER.info('%s %s: last %s, mean %s, max %s', name, event,
+                             stats['last'], stats['mean'], stats['max'])
+        return summary
+
+    def _cpumap(self):
+        cpumap = defaultdict(list)
+        for i in range(int(S.getValue('WL_VM_COUNT')) +
+                       int(S.getValue('WL_PROCESS_COUNT'))):
+            cpumap['WL' + str(i)] = S.getValue('WL_CORE_BINDING')[i]
+        return cpumap
+
+
+# threads of a QEMU process; vcpus maps the vCPU index to its thread id
+QemuThreadMap = namedtuple('QemuThreadMap', ['pid', 'vcpus', 'io',
+                                             'emulator'])
+_VCPU_THREAD = re.compile(r'^CPU (\d+)/')
 
 
 def mac_hash(s):
@@ -145,6 +934,7 @@ class QemuVM(tasks.Process):
     """
     def __init__(self, index):
         self._running = False
+        self._qmp = None
         self._logger = logging.getLogger(__name__)
         self._number = index
         self._logfile = os.path.join(
@@ -156,12 +946,13 @@ class QemuVM(tasks.Process):
         name = 'WL%d' % index
         vnc = ':%d' % pnumber
         self._shared_dir = '%s/qemu%d_share' % ('/tmp', pnumber)
-        if not os.path.exists(self._shared_dir):
-            try:
-                os.makedirs(self._shared_dir)
-            except OSError as exp:
-                raise OSError("Failed to create shared directory %s: %s" %
-                              self._shared_dir, exp)
+        # metrics files of the shared dir are kept in a subdir named by
+        # ``instance`` on stop, see archive_dir
+        self.archive_root = os.path.join(
+            S.getValue('LOG_DIR'), 'qemu%d_share-%s' %
+            (pnumber, time.strftime('%Y%m%d-%H%M%S')))
+        self.instance = None
+        self._starts = 0
 
         self.nics_nr = S.getValue('WL_NICS_NR')
         self.image = S.getValue('WL_IMAGE')[self._number]
@@ -174,14 +965,15 @@ class QemuVM(tasks.Process):
                          S.getValue('BOOT_DRIVE_TYPE')) +
                      self.image, '-boot',
                      'c', '--enable-kvm',
-                     '-monitor', 'unix:%s,server,nowait' % self._monitor,
+                     '-qmp', 'unix:%s,server,nowait' % self._monitor,
                      # '-object',
                      # 'memory-backend-file,id=mem,size=' +
                      # str(S.getValue('WL_MEMORY')[self._number]) + 'M,' +
                      # 'mem-path=' + S.getValue('HUGEPAGE_DIR') + ',share=on',
                      #'-numa', 'node,memdev=mem -mem-prealloc',
                      '-numa', 'node -mem-prealloc',
-                     '-nographic', '-vnc', str(vnc), '-name', name,
+                     '-nographic', '-vnc', str(vnc),
+                     '-name', name + ',debug-threads=on',
                      '-snapshot', '-net none', '-no-reboot',
                      '-drive',
                      'if=%s,format=raw,file=fat:rw:%s,snapshot=off' %
@@ -211,96 +1003,416 @@ class QemuVM(tasks.Process):
         Start QEMU instance
         """
         # print(self._cmd)
+        # stop() removes the shared dir, so it is created on every start
+        if not os.path.exists(self._shared_dir):
+            try:
+                os.makedirs(self._shared_dir)
+            except OSError as exp:
+                raise OSError("Failed to create shared directory %s: %s" %
+                              (self._shared_dir, exp))
+        self._starts += 1
+        self.instance = 'run%d-%s' % (self._starts,
+                                      time.strftime('%Y%m%d-%H%M%S'))
+        # a socket left by an earlier instance would count as ready
+        self._remove_monitor()
+        self._start_time = time.monotonic()
+        self.boot_time = None
         super(QemuVM, self).start()
         self._running = True
 
+    async def async_start(self, timeout=None):
+        """
+        Start QEMU instance and wait until it is ready, see
+        ``async_wait_until_booted``.
+
+        :returns: seconds from start until the instance was ready
+        """
+        self.start()
+        return await self.async_wait_until_booted(timeout)
+
     def stop(self):
         """
         Stops VNF instance.
+
+        The console output is drained by the OutputPump until QEMU has
+        exited, also if the guest never finished booting.
         """
         if self.is_running():
             self._logger.info('Killing WL...')
-            # force termination of VNF and wait to terminate; It will avoid
-            # sporadic reboot of host.
-            super(QemuVM, self).kill(signal='-9', sleep=10)
-        # remove shared dir if it exists to avoid issues with file consistency
-        if os.path.exists(self._shared_dir):
+            if not self.is_relinquished():
+                self.relinquish()
+        # force termination of VNF and wait to terminate; It will avoid
+        # sporadic reboot of host. The console log is written out and
+        # closed even if QEMU has already exited.
+        super(QemuVM, self).kill(
+            signal='-9', timeout_ms=S.getValue('WL_STOP_TIMEOUT_MS'))
+        if self._clean_shared_dir():
             tasks.run_task(['rm', '-f', '-r', self._shared_dir], self._logger,
                            'Removing content of shared directory...', True)
         self._running = False
 
+    async def async_stop(self):
+        """
+        Async version of ``stop``; the QEMU process tree is killed and
+        awaited on the event loop without blocking it.
+        """
+        timeout_ms = S.getValue('WL_STOP_TIMEOUT_MS')
+        if self.is_running():
+            self._logger.info('Killing WL...')
+            if not self.is_relinquished():
+                self.relinquish()
+            await asynctasks.terminate(self._child.pid, '-9', timeout_ms,
+                                       self._logger)
+        if self.is_relinquished():
+            deadline = time.monotonic() + timeout_ms / 1000.0
+            while (not self._relinquish_handle.done() and
+                   time.monotonic() < deadline):
+                await asyncio.sleep(0.05)
+        self._close_log()
+        if self._clean_shared_dir():
+            await asynctasks.run_task(
+                ['rm', '-f', '-r', self._shared_dir], self._logger,
+                'Removing content of shared directory...', True)
+        self._running = False
+
+    def _clean_shared_dir(self):
+        """
+        Close the QMP connection and archive the metrics files of the
+        shared dir.
+
+        :returns: True if the shared dir exists and has to be removed
+        """
+        if self._qmp:
+            self._qmp.close()
+            self._qmp = None
+        # remove shared dir if it exists to avoid issues with file consistency
+        if not os.path.exists(self._shared_dir):
+            return False
+        # a dir left by an earlier process belongs to no instance
+        if S.getValue('HARVEST_ARCHIVE') and self.instance:
+            copied = harvest.archive(self._shared_dir, self.archive_dir,
+                                     S.getValue('HARVEST_PATTERNS'))
+            if copied:
+                self._logger.info('Archived %d metrics files to %s',
+                                  len(copied), self.archive_dir)
+        return True
+
+    @property
+    def shared_dir(self):
+        """Host directory shared with the guest as a FAT drive."""
+        return self._shared_dir
+
+    @property
+    def archive_dir(self):
+        """Directory the shared dir of the current or last instance is
+        archived to, None before the first start."""
+        if not self.instance:
+            return None
+        return os.path.join(self.archive_root, self.instance)
+
+    def harvest_dirs(self):
+        """
+        Return the directories with metrics files of every instance of
+        this VM: the archive dirs of the stopped ones and the shared dir
+        of the current one.
+
+        :returns: list of (instance, directory) pairs
+        """
+        try:
+            instances = sorted(os.listdir(self.archive_root))
+        except OSError:
+            instances = []
+        dirs = [(instance, os.path.join(self.archive_root, instance))
+                for instance in instances]
+        if self.instance:
+            dirs.append((self.instance, self._shared_dir))
+        return dirs
+
     def print_cmd(self):
         print(self._cmd)
 
+    def wait_until_booted(self, timeout=None):
+        """
+        Wait until the QEMU instance is ready.
+
+        The instance is ready once its monitor socket exists and the guest
+        console shows WL_BOOT_MARKER. The console is then relinquished to
+        the OutputPump, which keeps draining it into the log.
+
+        :param timeout: Seconds to wait, defaults to WL_BOOT_TIMEOUT
+        :returns: seconds from start until the instance was ready
+        :raises RuntimeError: if the instance is not ready in time
+        """
+        if self.is_relinquished():
+            return self.boot_time
+        if not timeout:
+            timeout = S.getValue('WL_BOOT_TIMEOUT')
+        deadline = time.monotonic() + float(timeout)
+
+        while not self._monitor_ready(deadline, timeout):
+            time.sleep(0.1)
+
+        try:
+            self._child.expect([S.getValue('WL_BOOT_MARKER')],
+                               timeout=max(deadline - time.monotonic(), 0))
+        except pexpect.TIMEOUT:
+            self._boot_failed('guest did not boot within %s s' % timeout)
+        except pexpect.EOF:
+            self._boot_failed('exited while booting')
+        return self._booted()
+
+    async def async_wait_until_booted(self, timeout=None):
+        """
+        Async version of ``wait_until_booted``; the console is read by
+        the event loop whenever output is available, so many instances
+        are awaited on one loop.
+        """
+        if self.is_relinquished():
+            return self.boot_time
+        if not timeout:
+            timeout = S.getValue('WL_BOOT_TIMEOUT')
+        deadline = time.monotonic() + float(timeout)
+
+        while not self._monitor_ready(deadline, timeout):
+            await asyncio.sleep(0.1)
+
+        loop = asyncio.get_running_loop()
+        booted = loop.create_future()
+        marker = S.getValue('WL_BOOT_MARKER')
+
+        def read_console():
+            if booted.done():
+                return
+            try:
+                # matches output read before or reads what is available
+                self._child.expect([marker], timeout=0)
+            except pexpect.TIMEOUT:
+                return
+            except pexpect.EOF as exc:
+                booted.set_exception(exc)
+                return
+            booted.set_result(True)
+
+        loop.add_reader(self._child.child_fd, read_console)
+        try:
+            read_console()
+            await asyncio.wait_for(booted,
+                                   max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self._boot_failed('guest did not boot within %s s' % timeout)
+        except pexpect.EOF:
+            self._boot_failed('exited while booting')
+        finally:
+            loop.remove_reader(self._child.child_fd)
+        return self._booted()
+
+    def _booted(self):
+        self.boot_time = time.monotonic() - self._start_time
+        self._logger.info('WL%d booted in %.1f s', self._number,
+                          self.boot_time)
+        self.relinquish()
+        return self.boot_time
+
+    def _boot_failed(self, reason):
+        self.flush_log()
+        raise RuntimeError('WL%d %s, see %s' % (self._number, reason,
+                                                self.log_path()))
+
+    def _remove_monitor(self):
+        try:
+            os.remove(self._monitor)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # created by QEMU running as root
+            tasks.run_task(['sudo', 'rm', '-f', self._monitor],
+                           self._logger, None, True)
+
+    def _monitor_ready(self, deadline, timeout):
+        """
+        Returns True once the monitor socket exists.
+
+        :raises RuntimeError: if QEMU has exited or ``deadline`` passed
+        """
+        try:
+            if stat.S_ISSOCK(os.stat(self._monitor).st_mode):
+                return True
+        except OSError:
+            pass
+        if not self.is_running():
+            self._boot_failed('exited while booting')
+        if time.monotonic() > deadline:
+            raise RuntimeError('WL%d: monitor socket %s not available after '
+                               '%s s' % (self._number, self._monitor,
+                                         timeout))
+        return False
+
+    def qemu_pid(self):
+        """
+        Return the PID of the QEMU process of this instance.
+
+        QEMU runs a few levels below the spawned shell (shell, sudo,
+        taskset), so the descendants of the shell are searched.
+
+        :returns: PID or None if QEMU is not running
+        """
+        if not self.is_running():
+            return None
+        qemu_comm = os.path.basename(S.getValue('QEMU_CMD'))[:15]
+        for pid in [self._child.pid] + systeminfo.get_descendants(
+                self._child.pid):
+            comm = systeminfo.get_comm(pid)
+            if comm and (comm == qemu_comm or comm.startswith('qemu-')):
+                return pid
+        return None
+
+    def discover_threads(self):
+        """
+        Classify the threads of this QEMU instance.
+
+        Threads are classified by the names QEMU gives them with
+        debug-threads=on: 'CPU <n>/KVM' threads run vCPUs, 'IO ...' and
+        'worker' threads do I/O, all others emulate devices. Without
+        thread names the vCPU threads are queried over QMP.
+
+        :returns: QemuThreadMap
+        :raises RuntimeError: if the QEMU process cannot be found
+        """
+        pid = self.qemu_pid()
+        if pid is None:
+            raise RuntimeError('QEMU process of WL%d not found' %
+                               self._number)
+        vcpus = {}
+        io_threads = []
+        emulator = []
+        for tid, comm in systeminfo.get_threads(pid):
+            match = _VCPU_THREAD.match(comm)
+            if match:
+                vcpus[int(match.group(1))] = tid
+            elif comm.startswith('IO ') or comm in ('worker', 'iou-wrk'):
+                io_threads.append(tid)
+            else:
+                emulator.append(tid)
+
+        if not vcpus:
+            try:
+                vcpus = self.vcpu_threads()
+            except (OSError, qmp.QmpError) as exc:
+                self._logger.warning('Unable to query vCPU threads of WL%d: '
+                                     '%s', self._number, exc)
+            emulator = [tid for tid in emulator if tid not in vcpus.values()]
+        return QemuThreadMap(pid, vcpus, io_threads, emulator)
+
     def affinitize_workload(self):
         """
         Affinitize workload thread.
 
+        Every thread of this QEMU instance (vCPUs first, then I/O and
+        emulator threads) is pinned round-robin to WL<n>_CPU_MAP.
+
         :return: None
         """
         #self._logger.info('Affinitizing Workload threads.')
-        args1 = ['pgrep', 'qemu-']
-        process1 = subprocess.Popen(args1, stdout=subprocess.PIPE,
-                                    shell=False)
-        out = process1.communicate()[0]
-        processes = out.decode(locale.getdefaultlocale()[1]).split('\n')
-        if processes[-1] == '':
-            processes.pop() # pgrep may return an extra line with no data
-        #self._logger.info('Found %s workload threads...', len(processes))
-        print('Found %s workload threads...', len(processes))
+        threads = self.discover_threads()
+        processes = ([tid for _, tid in sorted(threads.vcpus.items())] +
+                     threads.io + threads.emulator)
+        self._logger.info('Found %s workload threads...', len(processes))
 
         cpumap = S.getValue('WL'+str(self._number)+'_CPU_MAP')
         mapcount = 0
+        pairs = []
         for proc in processes:
-            self._affinitize_pid(cpumap[mapcount], proc)
+            pairs.append((proc, cpumap[mapcount]))
             mapcount += 1
             if mapcount + 1 > len(cpumap):
                 # Not enough cpus were given in the mapping to cover all the
                 # threads on a 1 to 1 ratio with cpus so reset the list counter
                 #  to 0.
                 mapcount = 0
+        self._affinitize_pids(pairs)
 
     def _affinitize(self):
         """
         Affinitize the SMP cores of a QEMU instance.
 
-        This is a bit of a hack. The 'socat' utility is used to
-        interact with the QEMU HMP. This is necessary due to the lack
-        of QMP in older versions of QEMU, like v1.6.2. In future
-        releases, this should be replaced with calls to libvirt or
-        another Python-QEMU wrapper library.
+        The vCPU thread ids are queried over QMP; each vCPU is pinned
+        to the host core at the same position of WL_CORE_BINDING.
 
         :returns: None
         """
-        thread_id = (r'.* CPU #%d: .* thread_id=(\d+)')
-
         print('Affinitizing guest...')
 
-        cur_locale = locale.getdefaultlocale()[1]
-        proc = subprocess.Popen(
-            ('echo', 'info cpus'), stdout=subprocess.PIPE)
-        output = subprocess.check_output(
-            ('sudo', 'socat', '-', 'UNIX-CONNECT:%s' % self._monitor),
-            stdin=proc.stdout)
-        proc.wait()
-
-        # calculate the number of CPUs in SMP topology specified by GUEST_SMP
-        # e.g. "sockets=2,cores=3", "4", etc.
-        cpu_nr = 4
         # pin each GUEST's core to host core based on configured BINDING
-        for cpu in range(0, cpu_nr):
-            match = None
-            guest_thread_binding = S.getValue('WL_CORE_BINDING')[self._number]
-            for line in output.decode(cur_locale).split('\n'):
-                match = re.search(thread_id % cpu, line)
-                if match:
-                    self._affinitize_pid(guest_thread_binding[cpu], match.group(1))
-                    break
+        guest_thread_binding = S.getValue('WL_CORE_BINDING')[self._number]
+        self._affinitize_pids(
+            [(thread_id, guest_thread_binding[cpu])
+             for cpu, thread_id in sorted(self.vcpu_threads().items())
+             if cpu < len(guest_thread_binding)])
+
+    def qmp(self):
+        """
+        Return the QMP connection of this QEMU instance.
+
+        The connection to the monitor socket is opened on first use and
+        kept until the instance is stopped.
+
+        :returns: qmp.QmpClient
+        """
+        if not self._qmp or not self._qmp.is_connected():
+            if os.geteuid() != 0 and not os.access(self._monitor, os.W_OK):
+                # QEMU runs as root; hand its socket over once instead of
+                # running every monitor command through sudo
+                tasks.run_task(['sudo', 'chown', str(os.getuid()),
+                                self._monitor], self._logger, None, True)
+            self._qmp = qmp.QmpClient(self._monitor)
+            self._qmp.connect()
+        return self._qmp
+
+    def vcpu_threads(self):
+        """
+        Return the host thread id of every vCPU.
+
+        :returns: dict mapping the vCPU index to its thread id
+        """
+        try:
+            cpus = self.qmp().command('query-cpus-fast')
+            return dict((cpu['cpu-index'], cpu['thread-id']) for cpu in cpus)
+        except qmp.QmpError as exc:
+            if exc.error_class != 'CommandNotFound':
+                raise
+        # QEMU older than 2.12
+        cpus = self.qmp().command('query-cpus')
+        return dict((cpu['CPU'], cpu['thread_id']) for cpu in cpus)
+
+    def status(self):
+        """
+        Return the run state of the guest, e.g. 'running' or 'paused'.
+        """
+        return self.qmp().command('query-status')['status']
+
+    def pause(self):
+        """
+        Pause the guest vCPUs.
+        """
+        self.qmp().command('stop')
+
+    def resume(self):
+        """
+        Resume the guest vCPUs.
+        """
+        self.qmp().command('cont')
+
+    def quit(self):
+        """
+        Ask QEMU to exit.
+        """
+        self.qmp().command('quit')
 
 
 
 class StressorVM(object):
     def __init__(self):
+        self.boot_times = {}
         self.qvm_list = []
         for vmindex in range(int(S.getValue('WL_VM_COUNT'))):
             qvm = QemuVM(vmindex)
@@ -311,6 +1423,53 @@ class StressorVM(object):
         vm = self.qvm_list[index]
         vm.start()
 
+    def start_all(self, timeout=None):
+        """
+        Start all QEMU instances concurrently and wait until all of them
+        are ready.
+
+        :param timeout: Seconds to wait for each instance, defaults to
+            WL_BOOT_TIMEOUT
+        :returns: dict with the boot time in seconds of every instance
+        :raises RuntimeError: if any instance did not become ready; the
+            boot times are still available in ``boot_times``
+        """
+        self.boot_times, errors = asyncio.run(self._run_all(
+            'async_start', self.qvm_list, timeout))
+        if errors:
+            raise RuntimeError('Failed to start: ' + '; '.join(errors))
+        return self.boot_times
+
+    def stop_all(self):
+        """
+        Stop all running QEMU instances concurrently.
+        """
+        _, errors = asyncio.run(self._run_all(
+            'async_stop', [vm for vm in self.qvm_list if vm.is_running()]))
+        if errors:
+            raise RuntimeError('Failed to stop: ' + '; '.join(errors))
+
+    async def _run_all(self, method, vms, *args):
+        """
+        Await the coroutine ``method`` of all ``vms`` concurrently.
+
+        :returns: dict mapping the VM index to the result, None if it
+            failed, and a list of the errors
+        """
+        results = {}
+        errors = []
+        outcomes = await asyncio.gather(
+            *[getattr(vm, method)(*args) for vm in vms],
+            return_exceptions=True)
+        for vm, result in zip(vms, outcomes):
+            index = self.qvm_list.index(vm)
+            if isinstance(result, BaseException):
+                results[index] = None
+                errors.append('WL%d: %s' % (index, result))
+            else:
+                results[index] = result
+        return results, errors
+
     def stop(self, index):
         # for vm in self.qvm_list:
         vm = self.qvm_list[index]
@@ -336,7 +1495,20 @@ class StressorVM(object):
         """
         vm = self.qvm_list[index]
         vm.affinitize_workload()
-        
+
+    def wait_until_booted(self, index, timeout=None):
+        """
+        Wait until the guest of a QEMU instance has booted.
+        """
+        vm = self.qvm_list[index]
+        vm.wait_until_booted(timeout)
+
+    def is_running(self, index):
+        """
+        Returns True if the QEMU instance is running.
+        """
+        vm = self.qvm_list[index]
+        return bool(vm.is_running())
 
 
 def main():
@@ -344,6 +1516,39 @@ def main():
     S.load_from_dir(_CURR_DIR)
     vmcontrol = StressorVM()
     cachecontrol = CacheAllocator()
+    harvester = harvest.Harvester.from_vms(
+        vmcontrol.qvm_list, S.getValue('HARVEST_INTERVAL'),
+        S.getValue('HARVEST_PATTERNS'))
+    harvester.start()
+    try:
+        run_tester(vmcontrol, cachecontrol)
+    finally:
+        harvester.stop()
+        for name, stressors in sorted(harvester.summary().items()):
+            for stressor, stats in sorted(stressors.items()):
+                _LOGGER.info('%s %s: %d runs, %.2f bogo ops/s (%.2f - %.2f)',
+                             name, stressor, stats['runs'], stats['mean'],
+                             stats['min'], stats['max'])
+        harvester.save(os.path.join(
+            S.getValue('LOG_DIR'),
+            'stressng-%s.json' % time.strftime('%Y%m%d-%H%M%S')))
+    print("RMD-Testing is done, Goodbye!")
+
+
+def run_tester(vmcontrol, cachecontrol):
+    """
+    Run SCENARIO, or prompt for every step if it is empty.
+    """
+    if S.getValue('SCENARIO'):
+        runner = scenario.ScenarioRunner(S.getValue('SCENARIO'), vmcontrol,
+                                         cachecontrol)
+        try:
+            runner.run()
+        finally:
+            runner.save()
+        return
+    # reject an infeasible allocation before any workload is started
+    cachecontrol.plan_llc_allocation()
     input("Press Enter to start workload-1")
     vmcontrol.start(0)
     input("Enter to affinitize workload")
@@ -364,7 +1569,6 @@ def main():
     vmcontrol.stop(0)
     input("Press Enter to cleanup allocations")
     cachecontrol.cleanup_llc_allocation()
-    print("RMD-Testing is done, Goodbye!")
 
 
 if __name__ == "__main__":
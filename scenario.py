@@ -0,0 +1,237 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""Unattended, timed execution of a declarative list of test steps.
+
+A scenario is a list of step dicts, see SCENARIO in
+00_llcmanagemnt.conf, driving ``StressorVM`` and ``CacheAllocator``
+without any prompts. The wall clock time at which every step was
+reached (``scheduled``), its delay and the start/end time and duration
+of its action are recorded, so the timing between phases can be
+reproduced and analysed afterwards.
+"""
+
+import json
+import logging
+import os
+import time
+
+from conf import settings as S
+
+_LOGGER = logging.getLogger(__name__)
+
+VM_ACTIONS = ('start', 'stop', 'wait_boot', 'affinitize',
+              'affinitize_workload')
+ALLOCATION_ACTIONS = ('allocate', 'cleanup', 'log_allocations',
+                      'start_monitoring', 'stop_monitoring')
+ACTIONS = (VM_ACTIONS + ALLOCATION_ACTIONS +
+           ('start_all', 'stop_all', 'hold', 'repeat'))
+
+
+class ScenarioRunner(object):
+    """
+    Run scenario steps against a StressorVM and a CacheAllocator.
+    """
+    def __init__(self, steps, vmcontrol, cachecontrol):
+        """
+        :param steps: List of scenario step dicts
+        :param vmcontrol: StressorVM controlling the stressor VMs
+        :param cachecontrol: CacheAllocator used for allocations
+        """
+        self._steps = steps
+        self._vmcontrol = vmcontrol
+        self._cachecontrol = cachecontrol
+        self._allocated = False
+        self._logger = logging.getLogger(__name__)
+        self.records = []
+        self.validate()
+
+    def validate(self):
+        """
+        Check all steps before any of them is run.
+
+        :raises RuntimeError: listing every invalid step
+        """
+        errors = []
+        self._validate_steps(self._steps, 'step', errors)
+        if self._has_action(self._steps, 'allocate'):
+            try:
+                self._cachecontrol.plan_llc_allocation()
+            except RuntimeError as exc:
+                errors.append(str(exc))
+        if errors:
+            raise RuntimeError('Invalid scenario: ' + '; '.join(errors))
+
+    def run(self):
+        """
+        Run all steps in order.
+
+        If a step fails and SCENARIO_CLEANUP_ON_ERROR is set, all running
+        VMs are stopped and the allocations removed before the error is
+        raised again.
+
+        :returns: list of step records
+        """
+        self._logger.info('Running scenario with %d steps', len(self._steps))
+        try:
+            self._run_steps(self._steps, [])
+        except (Exception, KeyboardInterrupt):
+            if S.getValue('SCENARIO_CLEANUP_ON_ERROR'):
+                self._cleanup()
+            raise
+        return self.records
+
+    def save(self, path=None):
+        """
+        Save the step records as JSON.
+
+        :param path: Output file, defaults to a file in LOG_DIR
+        :returns: path of the written file
+        """
+        if not path:
+            path = os.path.join(S.getValue('LOG_DIR'), 'scenario-%s.json' %
+                                time.strftime('%Y%m%d-%H%M%S'))
+        with open(path, 'w') as file_:
+            json.dump({'steps': self._steps, 'records': self.records}, file_,
+                      indent=4, sort_keys=True)
+        self._logger.info('Scenario timestamps saved to %s', path)
+        return path
+
+    def _validate_steps(self, steps, name, errors):
+        vm_count = len(self._vmcontrol.qvm_list)
+        for index, step in enumerate(steps):
+            step_name = '%s %d' % (name, index)
+            action = step.get('action')
+            if action not in ACTIONS:
+                errors.append('%s: unknown action %r' % (step_name, action))
+                continue
+            if action in VM_ACTIONS and step.get('vm') not in range(vm_count):
+                errors.append('%s: %s needs a vm index below %d' %
+                              (step_name, action, vm_count))
+            if action == 'hold' and not isinstance(step.get('seconds'),
+                                                   (int, float)):
+                errors.append('%s: hold needs seconds' % step_name)
+            if action == 'repeat':
+                if not isinstance(step.get('steps'), list):
+                    errors.append('%s: repeat needs a list of steps' %
+                                  step_name)
+                else:
+                    self._validate_steps(step['steps'], step_name, errors)
+            if 'when' in step:
+                try:
+                    self._parse_condition(step['when'])
+                except ValueError as exc:
+                    errors.append('%s: %s' % (step_name, exc))
+
+    def _has_action(self, steps, action):
+        return any(step.get('action') == action or
+                   (step.get('action') == 'repeat' and
+                    isinstance(step.get('steps'), list) and
+                    self._has_action(step['steps'], action))
+                   for step in steps)
+
+    def _parse_condition(self, condition):
+        kind, _, vm = str(condition).partition(':')
+        kind = kind.strip().lower()
+        if kind in ('allocated', 'not allocated') and not vm:
+            return kind, None
+        if kind in ('running', 'stopped') and vm.strip().isdigit():
+            if int(vm) < len(self._vmcontrol.qvm_list):
+                return kind, int(vm)
+        raise ValueError('invalid condition %r' % condition)
+
+    def _condition_met(self, condition):
+        kind, vm = self._parse_condition(condition)
+        if kind == 'allocated':
+            return self._allocated
+        if kind == 'not allocated':
+            return not self._allocated
+        running = self._vmcontrol.is_running(vm)
+        return running if kind == 'running' else not running
+
+    def _run_steps(self, steps, path):
+        for index, step in enumerate(steps):
+            for iteration in range(int(step.get('repeat', 1))):
+                self._run_step(step, path + [index], iteration)
+
+    def _run_step(self, step, path, iteration):
+        action = step['action']
+        record = {'step': '.'.join(str(index) for index in path),
+                  'action': action,
+                  'vm': step.get('vm'),
+                  'iteration': iteration,
+                  'scheduled': time.time(),
+                  'delay': 0.0,
+                  'skipped': False}
+        self.records.append(record)
+        if step.get('delay'):
+            started = time.monotonic()
+            time.sleep(float(step['delay']))
+            record['delay'] = time.monotonic() - started
+        record['start'] = record['scheduled'] + record['delay']
+        if 'when' in step and not self._condition_met(step['when']):
+            record['skipped'] = True
+            record['end'] = record['start']
+            record['duration'] = 0.0
+            self._logger.info('Skipping step %s (%s): %s is not met',
+                              record['step'], action, step['when'])
+            return
+
+        self._logger.info('Step %s: %s', record['step'], action)
+        started = time.monotonic()
+        try:
+            if action == 'repeat':
+                for count in range(int(step.get('count', 1))):
+                    self._run_steps(step['steps'], path + [count])
+            else:
+                self._run_action(action, step)
+        except (Exception, KeyboardInterrupt) as exc:
+            record['error'] = str(exc) or exc.__class__.__name__
+            raise
+        finally:
+            record['duration'] = time.monotonic() - started
+            record['end'] = record['start'] + record['duration']
+
+    def _run_action(self, action, step):
+        vm = step.get('vm')
+        if action == 'start':
+            self._vmcontrol.start(vm)
+        elif action == 'stop':
+            self._vmcontrol.stop(vm)
+        elif action == 'start_all':
+            self._vmcontrol.start_all(step.get('timeout'))
+        elif action == 'stop_all':
+            self._vmcontrol.stop_all()
+        elif action == 'wait_boot':
+            self._vmcontrol.wait_until_booted(vm, step.get('timeout'))
+        elif action == 'affinitize':
+            self._vmcontrol.affinitize(vm)
+        elif action == 'affinitize_workload':
+            self._vmcontrol.affinitize_workload(vm)
+        elif action == 'allocate':
+            self._cachecontrol.setup_llc_allocation()
+            self._allocated = True
+        elif action == 'cleanup':
+            self._cachecontrol.cleanup_llc_allocation()
+            self._allocated = False
+        elif action == 'log_allocations':
+            self._cachecontrol.log_allocations()
+        elif action == 'start_monitoring':
+            self._cachecontrol.start_monitoring()
+        elif action == 'stop_monitoring':
+            self._cachecontrol.stop_monitoring()
+        elif action == 'hold':
+            time.sleep(float(step['seconds']))
+
+    def _cleanup(self):
+        self._logger.warning('Scenario failed, stopping VMs and removing '
+                             'allocations')
+        for index in range(len(self._vmcontrol.qvm_list)):
+            try:
+                if self._vmcontrol.is_running(index):
+                    self._vmcontrol.stop(index)
+            except Exception as exc:  # pylint: disable=broad-except
+                self._logger.error('Failed to stop WL%d: %s', index, exc)
+        try:
+            self._cachecontrol.cleanup_llc_allocation()
+        except Exception as exc:  # pylint: disable=broad-except
+            self._logger.error('Failed to remove allocations: %s', exc)
@@ -178,6 +178,74 @@ def pid_isalive(pid):
     """
     return os.path.isdir('/proc/' + str(pid))
 
+def get_process_tree(proc_dir='/proc'):
+    """ Snapshot the parent/child relation of all processes
+
+    :param proc_dir: Mount point of procfs
+    :returns: dict mapping every PID to the list of its child PIDs
+    """
+    tree = {}
+    for entry in os.listdir(proc_dir):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join(proc_dir, entry, 'stat')) as file_:
+                stat = file_.read()
+        except OSError:
+            # process has exited meanwhile
+            continue
+        # comm may contain spaces and parentheses; ppid follows the state
+        # field after the last ')'
+        ppid = int(stat.rpartition(')')[2].split()[1])
+        tree.setdefault(ppid, []).append(int(entry))
+    return tree
+
+def get_descendants(pid, tree=None):
+    """ Get all descendants of given PID
+
+    :param pid: PID of the process
+    :param tree: Process tree as returned by ``get_process_tree``
+    :returns: list of descendant PIDs, parents before their children
+    """
+    if tree is None:
+        tree = get_process_tree()
+    descendants = []
+    pending = [int(pid)]
+    while pending:
+        children = tree.get(pending.pop(0), [])
+        descendants.extend(children)
+        pending.extend(children)
+    return descendants
+
+def get_comm(pid, proc_dir='/proc'):
+    """ Get the command name of given PID or thread ID
+
+    :returns: command name or None if the process is not running
+    """
+    try:
+        with open(os.path.join(proc_dir, str(pid), 'comm')) as file_:
+            return file_.read().rstrip('\n')
+    except OSError:
+        return None
+
+def get_threads(pid, proc_dir='/proc'):
+    """ Get all threads of given PID
+
+    :returns: list of (thread ID, command name) tuples ordered by thread
+        ID; empty if the process is not running
+    """
+    task_dir = os.path.join(proc_dir, str(pid), 'task')
+    try:
+        tids = sorted(int(tid) for tid in os.listdir(task_dir))
+    except OSError:
+        return []
+    threads = []
+    for tid in tids:
+        comm = get_comm(tid, task_dir)
+        if comm is not None:
+            threads.append((tid, comm))
+    return threads
+
 def get_bin_version(binary, regex):
     """ get version of given binary selected by given regex
 
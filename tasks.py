@@ -1,7 +1,11 @@
 """Task management helper functions and classes.
 """
 
+import codecs
+import collections
 import select
+import selectors
+import signal as signal_module
 import subprocess
 import logging
 import threading
@@ -12,10 +16,15 @@ import time
 import pexpect
 
 from conf import settings
+import affinity
+import logsink
 import systeminfo
 
 
 CMD_PREFIX = 'cmd : '
+_READ_CHUNK = 65536
+_STREAM_POLL_INTERVAL = 0.1
+_PUMP_FLUSH_INTERVAL = 1.0
 
 def _get_stdout():
     """Get stdout value for ``subprocess`` calls.
@@ -28,7 +37,121 @@ def _get_stdout():
     return stdout
 
 
-def run_task(cmd, logger, msg=None, check_error=False):
+class OutputBuffer(object):
+    """Ring buffer keeping the last ``limit`` bytes written to it.
+
+    Output is stored as raw chunks and only decoded on request, so
+    capturing a chatty command costs one append per read.
+    """
+    def __init__(self, limit=None):
+        """
+        :param limit: Maximum number of bytes kept, None keeps everything
+        """
+        self._limit = limit
+        self._chunks = collections.deque()
+        self._size = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, data):
+        """Add ``data``, dropping the oldest bytes beyond the limit.
+        """
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._limit is None:
+            return
+        while self._size > self._limit:
+            excess = self._size - self._limit
+            first = self._chunks[0]
+            if len(first) <= excess:
+                self._chunks.popleft()
+                self._size -= len(first)
+                self.dropped += len(first)
+            else:
+                self._chunks[0] = first[excess:]
+                self._size -= excess
+                self.dropped += excess
+
+    def getvalue(self):
+        """Return the kept bytes.
+
+        If output was dropped, the leading partial line is removed too.
+        """
+        data = b''.join(self._chunks)
+        if self.dropped:
+            newline = data.find(b'\n')
+            data = data[newline + 1:] if newline >= 0 else b''
+        return data
+
+    def lines(self, encoding=None):
+        """Return the kept output as a list of stripped text lines.
+        """
+        text = self.getvalue().decode(encoding or 'utf-8', 'replace')
+        return [line.strip() for line in text.splitlines()]
+
+
+def _echo(stream, encoding):
+    """Return a tee callback writing decoded chunks to ``stream``.
+    """
+    decoder = codecs.getincrementaldecoder(encoding or 'utf-8')('replace')
+
+    def write(data):
+        stream.write(decoder.decode(data))
+        stream.flush()
+    return write
+
+
+def capture_output(proc, limit=None, tee=None, echo_stdout=False,
+                   echo_stderr=True, encoding=None):
+    """Capture stdout and stderr of ``proc`` until both are closed.
+
+    Both pipes are read in non-blocking chunks from a single selector,
+    so a child filling one pipe can never stall reading the other.
+
+    :param proc: ``subprocess.Popen`` with stdout and stderr pipes
+    :param limit: Maximum number of bytes kept per stream
+    :param tee: Optional callback called with ('stdout' or 'stderr', bytes)
+        for every chunk read
+    :param echo_stdout: Write stdout to ``sys.stdout`` as it arrives
+    :param echo_stderr: Write stderr to ``sys.stderr`` as it arrives
+    :param encoding: Encoding used for echoing
+
+    :returns: (stdout OutputBuffer, stderr OutputBuffer)
+    """
+    buffers = {'stdout': OutputBuffer(limit), 'stderr': OutputBuffer(limit)}
+    echoes = {'stdout': _echo(sys.stdout, encoding) if echo_stdout else None,
+              'stderr': _echo(sys.stderr, encoding) if echo_stderr else None}
+
+    with selectors.DefaultSelector() as selector:
+        for name in ('stdout', 'stderr'):
+            pipe = getattr(proc, name)
+            os.set_blocking(pipe.fileno(), False)
+            selector.register(pipe, selectors.EVENT_READ, name)
+
+        while selector.get_map():
+            for key, _ in selector.select():
+                try:
+                    data = os.read(key.fd, _READ_CHUNK)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    continue
+                buffers[key.data].append(data)
+                if echoes[key.data]:
+                    echoes[key.data](data)
+                if tee:
+                    tee(key.data, data)
+
+    proc.wait()
+    return buffers['stdout'], buffers['stderr']
+
+
+def run_task(cmd, logger, msg=None, check_error=False, limit_kb=None,
+             tee=None):
     """Run task, report errors and log overall status.
 
     Run given task using ``subprocess.Popen``. Log the commands
@@ -36,10 +159,16 @@ def run_task(cmd, logger, msg=None, check_error=False):
     in verbose mode and returns it regardless. Prints stderr to
     screen always.
 
+    Only the last TASK_OUTPUT_LIMIT_KB of each stream is kept.
+
     :param cmd: Exact command to be executed
     :param logger: Logger to write details to
     :param msg: Message to be shown to user
     :param check_error: Throw exception on error
+    :param limit_kb: Output kept per stream in KB, defaults to
+        TASK_OUTPUT_LIMIT_KB; 0 keeps everything
+    :param tee: Optional callback called with ('stdout' or 'stderr', bytes)
+        for every chunk of output
 
     :returns: (stdout, stderr)
     """
@@ -52,53 +181,147 @@ def run_task(cmd, logger, msg=None, check_error=False):
         if check_error:
             raise exception
 
-    stdout = []
-    stderr = []
+    stdout = stderr = OutputBuffer()
     my_encoding = locale.getdefaultlocale()[1]
+    if limit_kb is None:
+        limit_kb = settings.getValue('TASK_OUTPUT_LIMIT_KB')
+    verbose = settings.getValue('VERBOSITY') == 'debug'
 
     if msg:
         logger.info(msg)
 
-    # pylint: disable=too-many-nested-blocks
     logger.debug('%s%s', CMD_PREFIX, ' '.join(cmd))
     try:
         proc = subprocess.Popen(map(os.path.expanduser, cmd),
                                 stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE, bufsize=0)
-
-        while True:
-            reads = [proc.stdout.fileno(), proc.stderr.fileno()]
-            ret = select.select(reads, [], [])
-
-            for file_d in ret[0]:
-                if file_d == proc.stdout.fileno():
-                    while True:
-                        line = proc.stdout.readline()
-                        if not line:
-                            break
-                        if settings.getValue('VERBOSITY') == 'debug':
-                            sys.stdout.write(line.decode(my_encoding))
-                        stdout.append(line)
-                if file_d == proc.stderr.fileno():
-                    while True:
-                        line = proc.stderr.readline()
-                        if not line:
-                            break
-                        sys.stderr.write(line.decode(my_encoding))
-                        stderr.append(line)
-
-            if proc.poll() is not None:
-                break
-
+        stdout, stderr = capture_output(proc, int(limit_kb * 1024) or None,
+                                        tee, echo_stdout=verbose,
+                                        encoding=my_encoding)
     except OSError as ex:
         handle_error(ex)
     else:
+        for name, output in (('stdout', stdout), ('stderr', stderr)):
+            if output.dropped:
+                logger.debug('Dropped first %d bytes of %s of %s',
+                             output.dropped, name, cmd[0])
         if proc.returncode:
-            ex = subprocess.CalledProcessError(proc.returncode, cmd, stderr)
+            ex = subprocess.CalledProcessError(proc.returncode, cmd,
+                                               stderr.getvalue())
             handle_error(ex)
 
-    return ('\n'.join(sout.decode(my_encoding).strip() for sout in stdout),
-            ('\n'.join(sout.decode(my_encoding).strip() for sout in stderr)))
+    return ('\n'.join(stdout.lines(my_encoding)),
+            '\n'.join(stderr.lines(my_encoding)))
+
+def stream_task(cmd, logger, msg=None, timeout=None, cancel=None,
+                parser=None, merge_stderr=False, check_error=False,
+                kill_timeout_ms=1000):
+    """Run task and yield its output while it is produced.
+
+    Run given task using ``subprocess.Popen`` and yield every line of
+    its stdout as soon as it is complete. Prints stderr to screen
+    always, unless it is merged into the yielded stream. The process
+    is terminated when the generator is closed, cancelled or timed out
+    before the process has exited.
+
+    :param cmd: Exact command to be executed
+    :param logger: Logger to write details to
+    :param msg: Message to be shown to user
+    :param timeout: Maximum run time in seconds, None for no limit
+    :param cancel: Optional ``threading.Event``; once set, the process is
+        terminated and the generator stops
+    :param parser: Optional callable converting every line to a record;
+        lines for which it returns None are skipped
+    :param merge_stderr: Yield stderr lines together with stdout
+    :param check_error: Throw exception if the process fails
+    :param kill_timeout_ms: Maximum delay in milliseconds for the
+        process to exit after it was signalled
+
+    :returns: generator of decoded lines (without line end) or records
+    :raises subprocess.TimeoutExpired: if ``timeout`` elapsed
+    """
+    my_encoding = locale.getdefaultlocale()[1]
+    decoder = codecs.getincrementaldecoder(my_encoding or 'utf-8')('replace')
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    if msg:
+        logger.info(msg)
+
+    logger.debug('%s%s', CMD_PREFIX, ' '.join(cmd))
+    proc = subprocess.Popen(map(os.path.expanduser, cmd),
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT if merge_stderr else None,
+                            bufsize=0)
+    os.set_blocking(proc.stdout.fileno(), False)
+    selector = selectors.DefaultSelector()
+    selector.register(proc.stdout, selectors.EVENT_READ)
+    pending = ''
+    try:
+        while True:
+            if cancel is not None and cancel.is_set():
+                logger.debug('Streaming of %s cancelled', cmd[0])
+                return
+            wait = _STREAM_POLL_INTERVAL if cancel is not None else None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                wait = remaining if wait is None else min(wait, remaining)
+            if not selector.select(wait):
+                continue
+            try:
+                data = os.read(proc.stdout.fileno(), _READ_CHUNK)
+            except BlockingIOError:
+                continue
+            if not data:
+                break
+            lines = (pending + decoder.decode(data)).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                record = _parse_line(line.rstrip('\r'), parser)
+                if record is not None:
+                    yield record
+
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            record = _parse_line(pending.rstrip('\r'), parser)
+            if record is not None:
+                yield record
+        # the output may be closed before the process exits
+        while proc.poll() is None:
+            if cancel is not None and cancel.is_set():
+                logger.debug('Streaming of %s cancelled', cmd[0])
+                return
+            wait = _STREAM_POLL_INTERVAL
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                wait = min(wait, remaining)
+            try:
+                proc.wait(wait)
+            except subprocess.TimeoutExpired:
+                pass
+        if proc.returncode and check_error:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+    finally:
+        selector.close()
+        proc.stdout.close()
+        if proc.poll() is None:
+            terminate_task(proc.pid, logger=logger,
+                           timeout_ms=kill_timeout_ms)
+            try:
+                proc.wait(kill_timeout_ms / 1000.0)
+            except subprocess.TimeoutExpired:
+                logger.warning('%s (pid %d) did not exit after SIGKILL',
+                               cmd[0], proc.pid)
+        if proc.returncode:
+            logger.debug('%s exited with %d', cmd[0], proc.returncode)
+
+def _parse_line(line, parser):
+    """Convert streamed line with optional parser
+    """
+    return parser(line) if parser else line
 
 def run_background_task(cmd, logger, msg):
     """Run task in background and log when started.
@@ -144,55 +367,320 @@ def run_interactive_task(cmd, logger, msg):
 
     return child
 
-def terminate_task_subtree(pid, signal='-15', sleep=10, logger=None):
-    """Terminate given process and all its children
+def terminate_task_subtree(pid, signal='-15', sleep=10, logger=None,
+                           timeout_ms=None, kill_timeout_ms=None):
+    """Terminate given process and all its descendants
 
-    Function will sent given signal to the process. In case
-    that process will not terminate within given sleep interval
-    and signal was not SIGKILL, then process will be killed by SIGKILL.
-    After that function will check if all children of the process
-    are terminated and if not the same terminating procedure is applied
-    on any living child (only one level of children is considered).
+    Function will snapshot the whole process tree below the given
+    process from /proc and send given signal to all of its processes
+    at once. All of them are awaited concurrently under one shared
+    deadline. Processes which did not terminate within this deadline
+    are killed by SIGKILL together, unless the signal was SIGKILL.
 
     :param pid: Process ID to terminate
-    :param signal: Signal to be sent to the process
+    :param signal: Signal to be sent to the processes
     :param sleep: Maximum delay in seconds after signal is sent
     :param logger: Logger to write details to
-    """
-    try:
-        output = subprocess.check_output("pgrep -P " + str(pid), shell=True).decode().rstrip('\n')
-    except subprocess.CalledProcessError:
-        output = ""
-
-    terminate_task(pid, signal, sleep, logger)
+    :param timeout_ms: Maximum delay in milliseconds after signal is
+        sent; overrides ``sleep``
+    :param kill_timeout_ms: Maximum delay in milliseconds after SIGKILL
+        is sent on escalation; defaults to ``timeout_ms``
 
-    # just for case children were kept alive
-    children = output.split('\n')
-    for child in children:
-        terminate_task(child, signal, sleep, logger)
+    :returns: True if all processes have terminated
+    """
+    pids = [int(pid)] + systeminfo.get_descendants(pid)
+    return terminate_tasks(pids, signal, sleep, logger, timeout_ms,
+                           kill_timeout_ms)
 
-def terminate_task(pid, signal='-15', sleep=10, logger=None):
+def terminate_task(pid, signal='-15', sleep=10, logger=None, timeout_ms=None,
+                   kill_timeout_ms=None):
     """Terminate process with given pid
 
     Function will sent given signal to the process. In case
-    that process will not terminate within given sleep interval
+    that process will not terminate within given timeout
     and signal was not SIGKILL, then process will be killed by SIGKILL.
+    The exit of the process is awaited with a pidfd, so the function
+    returns as soon as the process is gone.
 
     :param pid: Process ID to terminate
     :param signal: Signal to be sent to the process
     :param sleep: Maximum delay in seconds after signal is sent
     :param logger: Logger to write details to
+    :param timeout_ms: Maximum delay in milliseconds after signal is
+        sent; overrides ``sleep``
+    :param kill_timeout_ms: Maximum delay in milliseconds after SIGKILL
+        is sent on escalation; defaults to ``timeout_ms``
+
+    :returns: True if the process has terminated
     """
-    if systeminfo.pid_isalive(pid):
-        run_task(['sudo', 'kill', signal, str(pid)], logger)
-        logger.debug('Wait for process %s to terminate after signal %s', pid, signal)
-        for dummy in range(sleep):
-            time.sleep(1)
-            if not systeminfo.pid_isalive(pid):
+    return terminate_tasks([pid], signal, sleep, logger, timeout_ms,
+                           kill_timeout_ms)
+
+def terminate_tasks(pids, signal='-15', sleep=10, logger=None,
+                    timeout_ms=None, kill_timeout_ms=None):
+    """Terminate all processes with given pids
+
+    See ``terminate_task``; the processes are signalled together and
+    awaited under one shared deadline.
+
+    :returns: True if all processes have terminated
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    if timeout_ms is None:
+        timeout_ms = int(sleep) * 1000
+    if kill_timeout_ms is None:
+        kill_timeout_ms = timeout_ms
+
+    alive = [pid for pid in pids if systeminfo.pid_isalive(pid)]
+    if not alive:
+        return True
+
+    send_signal(alive, signal, logger)
+    logger.debug('Wait for processes %s to terminate after signal %s',
+                 ' '.join(str(pid) for pid in alive), signal)
+    alive = wait_for_exit_all(alive, timeout_ms)
+    if not alive:
+        return True
+
+    if signal.lstrip('-').upper() not in ('9', 'KILL', 'SIGKILL'):
+        return terminate_tasks(alive, '-9', sleep, logger, kill_timeout_ms)
+    return False
+
+def send_signal(pids, signal, logger):
+    """Send signal to processes with given pids
+
+    The signal is sent directly where permitted; all remaining processes
+    are signalled by a single ``sudo kill``.
+
+    :param pids: Process ID or list of process IDs to signal
+    :param signal: Signal in ``kill`` syntax, e.g. '-9' or '-TERM'
+    :param logger: Logger to write details to
+    """
+    if not isinstance(pids, (list, tuple, set)):
+        pids = [pids]
+    signum = _signal_number(signal)
+    denied = []
+    for pid in pids:
+        try:
+            os.kill(int(pid), signum)
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            denied.append(str(pid))
+    if denied:
+        run_task(['sudo', 'kill', signal] + denied, logger)
+
+def _signal_number(signal):
+    """Convert signal in ``kill`` syntax to its number
+
+    :raises ValueError: if the signal is unknown
+    """
+    name = signal.lstrip('-').upper()
+    if name.isdigit():
+        return int(name)
+    if not name.startswith('SIG'):
+        name = 'SIG' + name
+    try:
+        return int(signal_module.Signals[name])
+    except KeyError:
+        raise ValueError('Unknown signal %r' % signal)
+
+def wait_for_exit(pid, timeout_ms):
+    """Wait until process with given pid exits
+
+    :param pid: Process ID to wait for
+    :param timeout_ms: Maximum delay in milliseconds
+
+    :returns: True if the process has exited
+    """
+    return not wait_for_exit_all([pid], timeout_ms)
+
+def wait_for_exit_all(pids, timeout_ms):
+    """Wait until all processes with given pids exit
+
+    Uses a pidfd per process, which becomes readable the moment the
+    process exits, and polls all of them together. On systems without
+    pidfd support (Linux < 5.3) the process states are polled with a
+    short interval instead.
+
+    :param pids: Process IDs to wait for
+    :param timeout_ms: Maximum delay in milliseconds for all processes
+
+    :returns: list of process IDs which are still alive
+    """
+    deadline = time.monotonic() + max(timeout_ms, 0) / 1000.0
+    pidfds = {}
+    polled = []
+    try:
+        for pid in pids:
+            try:
+                pidfds[os.pidfd_open(int(pid))] = pid
+            except ProcessLookupError:
+                continue
+            except (AttributeError, OSError):
+                polled.append(pid)
+
+        poller = select.poll()
+        for pidfd in pidfds:
+            poller.register(pidfd, select.POLLIN)
+        interval = 0.01
+        while pidfds or polled:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
                 break
+            if polled:
+                wait = min(interval, remaining)
+                interval = min(interval * 2, 0.2)
+            else:
+                wait = remaining
+            for pidfd, _ in poller.poll(int(wait * 1000) + 1):
+                poller.unregister(pidfd)
+                os.close(pidfd)
+                del pidfds[pidfd]
+            polled = [pid for pid in polled if systeminfo.pid_isalive(pid)]
+    finally:
+        for pidfd in pidfds:
+            os.close(pidfd)
+
+    return list(pidfds.values()) + polled
+
+class RelinquishHandle(object):
+    """Handle of a child whose output is drained by the ``OutputPump``.
+    """
+    def __init__(self, child):
+        self.child = child
+        self._done = threading.Event()
+
+    def done(self):
+        """Returns True once the output of the child reached EOF.
+        """
+        return self._done.is_set()
+
+    def join(self, timeout=None):
+        """Wait until the output of the child reached EOF.
+
+        :param timeout: Maximum delay in seconds, None waits forever
+
+        :returns: True if the child's output is fully drained
+        """
+        return self._done.wait(timeout)
+
+
+class OutputPump(object):
+    """Drain output of relinquished children from a single thread.
+
+    All registered ptys are multiplexed with one epoll instance, so
+    relinquished processes cost nothing while they are silent and no
+    thread per process is needed. Output is read through pexpect, so it
+    is still written to the child's logfile. The pump thread is pinned
+    to HOUSEKEEPING_CPUS, if set, to keep it off the workload cores.
+    Pending log output of silent children is flushed every
+    _PUMP_FLUSH_INTERVAL seconds and written out completely on EOF.
+    """
+    def __init__(self, cpus=None):
+        """
+        :param cpus: CPUs to pin the pump thread to, in any format
+            understood by ``affinity.parse_cpu_list``
+        """
+        self._cpus = cpus
+        self._epoll = select.epoll()
+        self._handles = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, child):
+        """Drain output of pexpect ``child`` until EOF.
+
+        :returns: ``RelinquishHandle`` of the child
+        """
+        handle = RelinquishHandle(child)
+        with self._lock:
+            if child.child_fd in self._handles:
+                # fd of a closed child reused before its EOF was seen
+                self._remove(child.child_fd)
+            self._handles[child.child_fd] = handle
+            self._epoll.register(child.child_fd, select.EPOLLIN)
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run,
+                                                name='output-pump')
+                self._thread.daemon = True
+                self._thread.start()
+        return handle
+
+    def _run(self):
+        if self._cpus:
+            error = affinity.pin_threads([(threading.get_native_id(),
+                                           self._cpus)])
+            error = list(error.values())[0]
+            if error:
+                logging.getLogger(__name__).error(
+                    'Unable to pin output pump to %s: %s', self._cpus, error)
+        while True:
+            events = self._epoll.poll(_PUMP_FLUSH_INTERVAL)
+            for file_d, _ in events:
+                with self._lock:
+                    handle = self._handles.get(file_d)
+                if handle and not self._drain(handle):
+                    with self._lock:
+                        if self._handles.get(file_d) is handle:
+                            self._remove(file_d)
+            if not events:
+                with self._lock:
+                    handles = list(self._handles.values())
+                for handle in handles:
+                    _flush_log(handle.child, sync=False)
+
+    def _remove(self, file_d):
+        handle = self._handles.pop(file_d)
+        try:
+            self._epoll.unregister(file_d)
+        except OSError:
+            pass
+        _flush_log(handle.child)
+        handle._done.set()  # pylint: disable=protected-access
+
+    @staticmethod
+    def _drain(handle):
+        """Read available output; returns False on EOF
+        """
+        try:
+            handle.child.read_nonblocking(_READ_CHUNK, timeout=0)
+        except pexpect.TIMEOUT:
+            pass
+        except (pexpect.EOF, OSError, ValueError):
+            return False
+        return True
 
-        if signal.lstrip('-').upper() not in ('9', 'KILL', 'SIGKILL') and systeminfo.pid_isalive(pid):
-            terminate_task(pid, '-9', sleep, logger)
+
+def _flush_log(child, sync=True):
+    """Write pending output of ``child`` to its logfile
+
+    :param sync: write everything, not only if a flush is due
+    """
+    logfile = getattr(child, 'logfile', None)
+    if logfile is None or getattr(logfile, 'closed', False):
+        return
+    try:
+        if sync and hasattr(logfile, 'sync'):
+            logfile.sync()
+        else:
+            logfile.flush()
+    except (OSError, ValueError):
+        pass
+
+
+_OUTPUT_PUMP = None
+_OUTPUT_PUMP_LOCK = threading.Lock()
+
+def get_output_pump():
+    """Return the shared ``OutputPump``, creating it on first use.
+    """
+    global _OUTPUT_PUMP  # pylint: disable=global-statement
+    with _OUTPUT_PUMP_LOCK:
+        if _OUTPUT_PUMP is None:
+            _OUTPUT_PUMP = OutputPump(settings.getValue('HOUSEKEEPING_CPUS'))
+        return _OUTPUT_PUMP
 
 class Process(object):
     """Control an instance of a long-running process.
@@ -208,7 +696,7 @@ class Process(object):
     _expect = None
     _timeout = -1
     _proc_name = 'unnamed process'
-    _relinquish_thread = None
+    _relinquish_handle = None
 
     # context manager
 
@@ -237,12 +725,13 @@ class Process(object):
         """
         print(self._cmd)
         print(settings.getValue('SHELL_CMD'))
+        self._relinquish_handle = None
         cmd = ' '.join(settings.getValue('SHELL_CMD') +
                        ['"%s"' % ' '.join(self._cmd)])
 
         self._child = run_interactive_task(cmd, self._logger,
                                            'Starting %s...' % self._proc_name)
-        self._child.logfile = open(self._logfile, 'w')
+        self._child.logfile = logsink.LogSink.from_settings(self._logfile)
 
     def expect(self, msg, timeout=None):
         """Expect string from process.
@@ -271,15 +760,17 @@ class Process(object):
         try:
             self._child.expect([msg], timeout=timeout)
         except pexpect.EOF as exc:
+            self.flush_log()
             self._logger.critical(
                 'An error occurred. Please check the logs (%s) for more'
-                ' information. Exiting...', self._logfile)
+                ' information. Exiting...', self.log_path())
             raise exc
         except pexpect.TIMEOUT as exc:
+            self.flush_log()
             self._logger.critical(
                 'Failed to execute in \'%d\' seconds. Please check the logs'
                 ' (%s) for more information. Exiting...',
-                timeout, self._logfile)
+                timeout, self.log_path())
             self.kill()
             raise exc
         except (Exception, KeyboardInterrupt) as exc:
@@ -287,20 +778,61 @@ class Process(object):
             self.kill()
             raise exc
 
-    def kill(self, signal='-15', sleep=10):
+    def kill(self, signal='-15', sleep=10, timeout_ms=None):
         """Kill process instance if it is alive.
 
+        The log of the process is written out and closed even if the
+        process has already exited.
+
         :param signal: signal to be sent to the process
         :param sleep: delay in seconds after signal is sent
+        :param timeout_ms: delay in milliseconds after signal is sent;
+            overrides ``sleep``
         """
+        if timeout_ms is None:
+            timeout_ms = int(sleep) * 1000
         if self.is_running():
-            terminate_task_subtree(self._child.pid, signal, sleep, self._logger)
+            terminate_task_subtree(self._child.pid, signal, sleep, self._logger,
+                                   timeout_ms)
+
+        if self.is_relinquished():
+            self._relinquish_handle.join(timeout_ms / 1000.0)
+        self._close_log()
+
+    def _close_log(self):
+        """Write out and close the log of the process.
+        """
+        if self._child and self._child.logfile:
+            self._child.logfile.close()
+        self._logger.info('Log available at %s', self.log_path())
+
+    def flush_log(self):
+        """Write all output of the process read so far to its log.
+        """
+        if self._child:
+            _flush_log(self._child)
+
+    def log_path(self):
+        """Return the path of the current log file of the process.
 
-            if self.is_relinquished():
-                self._relinquish_thread.join()
+        :returns: path of the log file, including a '.gz' suffix if it
+            is compressed
+        """
+        logfile = self._child.logfile if self._child else None
+        return getattr(logfile, 'path', None) or self._logfile
+
+    def log_tail(self, lines=None):
+        """Return the last lines of output of the process.
+
+        The lines are kept in memory, see LOG_TAIL_LINES.
+
+        :param lines: Number of lines, None for all kept lines
 
-        self._logger.info(
-            'Log available at %s', self._logfile)
+        :returns: list of lines
+        """
+        if self._child and self._child.logfile:
+            return self._child.logfile.tail(lines)
+        return []
 
     def is_relinquished(self):
         """Returns True if process is relinquished.
@@ -310,7 +842,7 @@ class Process(object):
 
         :returns: True if process is relinquished, else False.
         """
-        return self._relinquish_thread
+        return self._relinquish_handle is not None
 
     def is_running(self):
         """Returns True if process is running.
@@ -327,9 +859,21 @@ class Process(object):
 
         :returns: None
         """
-        run_task(['sudo', 'taskset', '-c', '-p', str(core),
-                  str(pid)],
-                 self._logger)
+        self._affinitize_pids([(pid, core)])
+
+    def _affinitize_pids(self, pairs):
+        """Affinitize several processes or threads in one batch.
+
+        :param pairs: List of (pid, core) pairs; core may also be a
+            list of cores in taskset format.
+
+        :returns: dict mapping every pid to None or an error message
+        """
+        results = affinity.pin_threads(pairs)
+        for pid, error in results.items():
+            if error:
+                self._logger.error('Unable to affinitize %s: %s', pid, error)
+        return results
 
     def affinitize(self, core):
         """Affinitize process to a specific ``core``.
@@ -343,22 +887,6 @@ class Process(object):
         if self.is_running():
             self._affinitize_pid(core, self._child.pid)
 
-    class ContinueReadPrintLoop(threading.Thread):
-        """Thread to read output from child and log.
-
-        Taken from: https://github.com/pexpect/pexpect/issues/90
-        """
-        def __init__(self, child):
-            self.child = child
-            threading.Thread.__init__(self)
-
-        def run(self):
-            while True:
-                try:
-                    self.child.read_nonblocking()
-                except (pexpect.EOF, pexpect.TIMEOUT):
-                    break
-
     def relinquish(self):
         """Relinquish control of process.
 
@@ -370,11 +898,13 @@ class Process(object):
 
             https://github.com/pexpect/pexpect/issues/90
 
-        It is hoped that future versions of pexpect will avoid this
-        issue.
+        The output is drained by the shared ``OutputPump`` thread.
+
+        :returns: ``RelinquishHandle``; its ``join`` waits until all
+            output of the process is drained
         """
-        self._relinquish_thread = self.ContinueReadPrintLoop(self._child)
-        self._relinquish_thread.start()
+        self._relinquish_handle = get_output_pump().register(self._child)
+        return self._relinquish_handle
 
 
 class CustomProcess(Process):
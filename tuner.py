@@ -0,0 +1,468 @@
+# Copyright 2017-2018 Spirent Communications.
+
+"""Search for the WL*_CA cache allocations with the best throughput.
+
+``Tuner`` sweeps the [min_cache, max_cache] pairs of a set of workloads
+while their VMs keep running. At every point the allocation is replaced
+through ``CacheAllocator`` and the throughput of every workload is
+measured by a pluggable measurement function, together with the LLC
+occupancy if resctrl monitoring is available. Points which cacheplan
+finds infeasible are skipped without allocating anything.
+
+Search strategies:
+
+grid
+    every feasible point
+random
+    TUNER_BUDGET points drawn from the grid
+halving
+    successive halving: all candidates are measured briefly, the better
+    half is measured again for twice as long, and so on
+
+By default the throughput is the bogo-ops/s of the stress-ng runs the
+guests finish during a measurement, see ``harvest.measure``.
+
+A point is measured in TUNER_ROUNDS slices of at least TUNER_MIN_SLICE
+seconds and abandoned as soon as it is clearly dominated by a point
+measured before. A point without a throughput of every workload is
+reported, but never Pareto optimal. The result is a table
+of all points with the Pareto optimal ones, more throughput of every
+workload for fewer cache ways, marked.
+
+Example::
+
+    python tuner.py --strategy halving --ways 2,4,6 --duration 60
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import time
+
+import harvest
+import rmdtester
+import tasks
+from conf import settings as S
+
+_LOGGER = logging.getLogger(__name__)
+_CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+
+STRATEGIES = ('grid', 'random', 'halving')
+# seconds a measure command may run longer than the measured duration
+_MEASURE_GRACE = 30
+
+
+def command_measure(command):
+    """
+    Return a measurement function running ``command`` for every workload.
+
+    The command is a format string with the fields ``wl`` and
+    ``duration``; it must finish after ``duration`` seconds and print
+    the throughput of the workload as the last word of its last numeric
+    output line. Its output is streamed, and a command still running
+    _MEASURE_GRACE seconds after ``duration`` is terminated.
+    """
+    def measure(workloads, duration):
+        results = {}
+        for name in workloads:
+            results[name] = float('nan')
+            try:
+                for value in tasks.stream_task(
+                        S.getValue('SHELL_CMD') +
+                        [command.format(wl=name, duration=duration)],
+                        _LOGGER, timeout=duration + _MEASURE_GRACE,
+                        parser=_last_number):
+                    results[name] = value
+            except subprocess.TimeoutExpired:
+                _LOGGER.warning('Measurement of %s timed out', name)
+            if math.isnan(results[name]):
+                _LOGGER.warning('No throughput of %s', name)
+        return results
+    return measure
+
+
+def _last_number(line):
+    try:
+        return float(line.split()[-1])
+    except (IndexError, ValueError):
+        return None
+
+
+def candidate_ranges(ways):
+    """
+    Return all [min_cache, max_cache] pairs of the given way counts.
+    """
+    ways = sorted(set(int(way) for way in ways))
+    return [(low, high) for low in ways for high in ways if low <= high]
+
+
+def dominates(first, second):
+    """
+    Return True if result ``first`` is at least as good as ``second`` in
+    every objective and better in one: more throughput per workload and
+    fewer cache ways.
+    """
+    better = first['ways'] < second['ways']
+    if first['ways'] > second['ways']:
+        return False
+    for name, value in second['throughput'].items():
+        other = first['throughput'].get(name)
+        if other is None or other != other or value != value:
+            return False
+        if other < value:
+            return False
+        better = better or other > value
+    return better
+
+
+def _key(point):
+    return tuple(sorted(point.items()))
+
+
+def pareto_front(results):
+    """
+    Mark every valid result which is not dominated by another one with
+    ``pareto`` set to True.
+    """
+    complete = [result for result in results
+                if result['valid'] and not result['pruned']]
+    for result in results:
+        result['pareto'] = (result in complete and
+                            not any(dominates(other, result)
+                                    for other in complete))
+    return results
+
+
+class Tuner(object):
+    """
+    Sweep the cache allocation of running workloads.
+    """
+    def __init__(self, cachecontrol, workloads, measure, ways=(2, 4, 6),
+                 strategy='grid', budget=None, duration=30, settle=5,
+                 rounds=3, margin=0.1, seed=None, min_slice=0):
+        """
+        :param cachecontrol: CacheAllocator used for the allocations
+        :param workloads: Names of the workloads to tune, e.g. ['WL0']
+        :param measure: Function called with the workload names and a
+            duration in seconds; returns a dict mapping every workload to
+            its throughput over that time
+        :param ways: Cache way counts used for min_cache and max_cache
+        :param strategy: 'grid', 'random' or 'halving'
+        :param budget: Maximum number of points for 'random' and
+            'halving', None for all
+        :param duration: Seconds to measure a point; for 'halving' the
+            duration of the last round
+        :param settle: Seconds to wait after reallocating
+        :param rounds: Number of slices a measurement is split into
+        :param margin: Relative throughput by which a point must trail a
+            measured point in every workload to be abandoned early
+        :param seed: Seed of the random point selection
+        :param min_slice: Minimum seconds of a measurement slice; fewer
+            slices are measured, or a longer one, if ``duration`` is
+            too short. Measurements which only see complete runs, see
+            harvest.measure, need slices longer than a run.
+        """
+        if strategy not in STRATEGIES:
+            raise RuntimeError('Unknown tuner strategy %r, expected one of '
+                               '%s' % (strategy, ', '.join(STRATEGIES)))
+        self.cachecontrol = cachecontrol
+        self.workloads = list(workloads)
+        self.measure = measure
+        self.ways = ways
+        self.strategy = strategy
+        self.budget = budget
+        self.duration = float(duration)
+        self.settle = float(settle)
+        self.rounds = max(int(rounds), 1)
+        self.margin = float(margin)
+        self.min_slice = float(min_slice)
+        self._random = random.Random(seed)
+        self._ways = {}
+        self._allocated = False
+        self.results = []
+
+    def points(self):
+        """
+        Return all feasible points of the search space.
+
+        :returns: list of dicts mapping every workload to a
+            (min_cache, max_cache) pair
+        """
+        ranges = candidate_ranges(self.ways)
+        points = []
+        for combination in itertools.product(ranges,
+                                             repeat=len(self.workloads)):
+            point = dict(zip(self.workloads, combination))
+            self._configure(point)
+            try:
+                plan = self.cachecontrol.plan_llc_allocation()
+            except RuntimeError as exc:
+                _LOGGER.debug('Skipping %s: %s', point, exc)
+                continue
+            self._ways[_key(point)] = (
+                sum(sum(alloc.ways.values())
+                    for alloc in plan.allocations.values()) if plan else
+                sum(high for _, high in combination))
+            points.append(point)
+        return points
+
+    def run(self):
+        """
+        Run the search and return the results with the Pareto front
+        marked, see ``table``.
+        """
+        names = ['POLICY_TYPE'] + [wl + '_CA' for wl in self.workloads]
+        saved = dict((name, S.getValue(name)) for name in names
+                     if name in S.__dict__)
+        try:
+            points = self.points()
+            _LOGGER.info('Tuning %s: %d feasible points, strategy %s',
+                         ', '.join(self.workloads), len(points),
+                         self.strategy)
+            if self.strategy != 'grid' and self.budget and \
+                    len(points) > self.budget:
+                points = self._random.sample(points, int(self.budget))
+            if self.strategy == 'halving':
+                self._halving(points)
+            else:
+                for point in points:
+                    self.evaluate(point, self.duration)
+        finally:
+            self._release()
+            for name in names:
+                if name in saved:
+                    S.setValue(name, saved[name])
+                elif name in S.__dict__:
+                    delattr(S, name)
+        return self.table()
+
+    def _halving(self, points):
+        levels = max(int(math.ceil(math.log(max(len(points), 1), 2))), 0)
+        duration = self.duration / 2 ** levels
+        rung = 0
+        while points:
+            results = [self.evaluate(point, duration, rung)
+                       for point in points]
+            if len(points) == 1:
+                break
+            ranked = sorted((result for result in results
+                             if result['valid'] and not result['pruned']),
+                            key=lambda result: -result['score'])
+            points = [result['point'] for result in
+                      ranked[:int(math.ceil(len(points) / 2.0))]]
+            duration *= 2
+            rung += 1
+
+    def evaluate(self, point, duration, rung=0):
+        """
+        Allocate ``point`` and measure it for ``duration`` seconds.
+
+        Slices in which a workload reported no throughput (NaN) are left
+        out of its mean. A point is only ``valid`` if every workload
+        reported a throughput in at least one slice.
+
+        :returns: result dict, also appended to ``results``
+        """
+        self._allocate(point)
+        result = {'point': point,
+                  'allocation': dict((name, list(point[name]))
+                                     for name in self.workloads),
+                  'ways': self._ways[_key(point)],
+                  'rung': rung,
+                  'duration': 0.0,
+                  'throughput': {},
+                  'occupancy': {},
+                  'valid': False,
+                  'pruned': False}
+        rounds = self.rounds
+        if self.min_slice:
+            rounds = max(min(rounds, int(duration // self.min_slice)), 1)
+        slice_ = max(duration / rounds, self.min_slice)
+        sampler = self._start_monitoring()
+        time.sleep(self.settle)
+        totals = dict((name, 0.0) for name in self.workloads)
+        measured = dict((name, 0.0) for name in self.workloads)
+        for _ in range(rounds):
+            for name, value in self.measure(self.workloads, slice_).items():
+                if value == value:
+                    totals[name] = totals.get(name, 0.0) + value * slice_
+                    measured[name] = measured.get(name, 0.0) + slice_
+            result['duration'] += slice_
+            result['throughput'] = dict(
+                (name, totals[name] / measured[name] if measured[name]
+                 else float('nan')) for name in totals)
+            result['valid'] = all(measured.values())
+            if result['valid'] and self._clearly_dominated(result, rung):
+                result['pruned'] = True
+                _LOGGER.info('Abandoning dominated point %s',
+                             result['allocation'])
+                break
+        if sampler:
+            summary = self.cachecontrol.stop_monitoring()
+            result['occupancy'] = dict(
+                (name, summary.get(name, {}).get('llc_occupancy', {})
+                 .get('mean')) for name in self.workloads)
+        result['score'] = (sum(result['throughput'].values())
+                           if result['valid'] else 0.0)
+        if not result['valid']:
+            _LOGGER.warning('%s: no throughput of %s', result['allocation'],
+                            ', '.join(name for name in self.workloads
+                                      if not measured[name]))
+        _LOGGER.info('%s: throughput %s', result['allocation'],
+                     result['throughput'])
+        self.results.append(result)
+        return result
+
+    def _clearly_dominated(self, result, rung):
+        scaled = {'ways': result['ways'],
+                  'throughput': dict((name, value * (1 + self.margin))
+                                     for name, value in
+                                     result['throughput'].items())}
+        return any(dominates(other, scaled) for other in self.results
+                   if other['rung'] == rung and other['valid'] and
+                   not other['pruned'])
+
+    def _configure(self, point):
+        S.setValue('POLICY_TYPE', 'CUSTOM')
+        for name, cache_range in point.items():
+            S.setValue(name + '_CA', list(cache_range))
+
+    def _allocate(self, point):
+        self._release()
+        self._configure(point)
+        self.cachecontrol.setup_llc_allocation()
+        self._allocated = True
+
+    def _release(self):
+        if self._allocated:
+            self.cachecontrol.cleanup_llc_allocation()
+            self._allocated = False
+
+    def _start_monitoring(self):
+        try:
+            return self.cachecontrol.start_monitoring()
+        except RuntimeError as exc:
+            _LOGGER.debug('No occupancy monitoring: %s', exc)
+            return None
+
+    def table(self):
+        """
+        Return all results, Pareto optimal ones marked with ``pareto``,
+        ordered by ways and score.
+
+        For 'halving' only the longest measurement of every point is
+        kept.
+        """
+        latest = {}
+        for result in self.results:
+            key = _key(result['point'])
+            if key not in latest or result['rung'] >= latest[key]['rung']:
+                latest[key] = result
+        results = pareto_front(list(latest.values()))
+        return sorted(results, key=lambda result: (result['ways'],
+                                                   -result['score']))
+
+
+def print_table(results, workloads):
+    """
+    Print the results as a table.
+    """
+    print('%-6s %-5s ' % ('pareto', 'ways') +
+          ' '.join('%-10s %12s %12s' % (name + '_CA', 'ops/s', 'llc KB')
+                   for name in workloads) + ' %s' % 'note')
+    for result in results:
+        cells = []
+        for name in workloads:
+            occupancy = result['occupancy'].get(name)
+            throughput = result['throughput'].get(name, float('nan'))
+            cells.append('%-10s %12s %12s' % (
+                '%d,%d' % tuple(result['allocation'][name]),
+                '%.1f' % throughput if throughput == throughput else '-',
+                '%.0f' % (occupancy / 1024) if occupancy is not None
+                else '-'))
+        print('%-6s %-5d ' % ('*' if result['pareto'] else '',
+                              result['ways']) +
+              ' '.join(cells) + ' %s' % ('no runs' if not result['valid']
+                                         else 'pruned' if result['pruned']
+                                         else ''))
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune the cache '
+                                     'allocation of the stressor VMs')
+    parser.add_argument('--workloads', default=None,
+                        help='comma separated workloads, defaults to '
+                        'TUNER_WORKLOADS')
+    parser.add_argument('--ways', type=_int_list, default=None,
+                        help='comma separated cache way counts, defaults '
+                        'to TUNER_WAYS')
+    parser.add_argument('--strategy', choices=STRATEGIES, default=None)
+    parser.add_argument('--budget', type=int, default=None)
+    parser.add_argument('--duration', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default=None,
+                        help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    S.load_from_dir(_CURR_DIR)
+    workloads = (args.workloads.split(',') if args.workloads else
+                 S.getValue('TUNER_WORKLOADS'))
+
+    vmcontrol = rmdtester.StressorVM()
+    cachecontrol = rmdtester.CacheAllocator()
+    harvester = None
+    if S.getValue('TUNER_MEASURE_CMD'):
+        measure = command_measure(S.getValue('TUNER_MEASURE_CMD'))
+    else:
+        harvester = harvest.Harvester.from_vms(
+            vmcontrol.qvm_list, S.getValue('HARVEST_INTERVAL'),
+            S.getValue('HARVEST_PATTERNS'))
+        measure = harvest.measure(harvester,
+                                  S.getValue('HARVEST_STRESSORS') or None)
+    tuner = Tuner(cachecontrol, workloads, measure,
+                  args.ways or S.getValue('TUNER_WAYS'),
+                  args.strategy or S.getValue('TUNER_STRATEGY'),
+                  args.budget or S.getValue('TUNER_BUDGET'),
+                  args.duration or S.getValue('TUNER_DURATION'),
+                  S.getValue('TUNER_SETTLE'), S.getValue('TUNER_ROUNDS'),
+                  S.getValue('TUNER_MARGIN'),
+                  args.seed if args.seed is not None else
+                  S.getValue('TUNER_SEED') or None,
+                  S.getValue('TUNER_MIN_SLICE'))
+    vmcontrol.start_all()
+    try:
+        for index in range(len(vmcontrol.qvm_list)):
+            vmcontrol.affinitize(index)
+        results = tuner.run()
+    finally:
+        vmcontrol.stop_all()
+        if harvester:
+            harvester.stop()
+            harvester.save(os.path.join(
+                S.getValue('LOG_DIR'),
+                'stressng-%s.json' % time.strftime('%Y%m%d-%H%M%S')))
+
+    output = args.output or os.path.join(
+        S.getValue('LOG_DIR'), 'tuner-%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    with open(output, 'w') as file_:
+        json.dump({'workloads': workloads, 'strategy': tuner.strategy,
+                   'results': [dict((key, value) for key, value in
+                                    result.items() if key != 'point')
+                               for result in results]},
+                  file_, indent=4, sort_keys=True)
+    print_table(results, workloads)
+    print('Results written to %s' % output)
+
+
+if __name__ == "__main__":
+    main()